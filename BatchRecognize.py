@@ -0,0 +1,192 @@
+# BatchRecognize.py
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+import CharClassifier
+import KnnEngine
+import ModelStore
+import PlateCache
+from Recognizer import LicensePlateRecognizer
+
+# module level variables ##########################################################################
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+CHUNK_SIZE = 8                  # số ảnh gửi cho 1 worker mỗi lần, giảm chi phí giao tiếp giữa các tiến trình
+PROGRESS_EVERY = 1000           # in tốc độ sau mỗi bấy nhiêu ảnh
+
+recognizer = None               # mỗi tiến trình worker nạp model 1 lần vào đây
+resizeTo = None
+
+
+###################################################################################################
+def iterImages(inputs, listFile=None):
+    # Liệt kê ảnh từ thư mục (đệ quy), glob, tên file, hoặc 1 file danh sách (mỗi dòng 1 đường dẫn, "-" = stdin)
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(item):
+            yield item
+        else:
+            yield from sorted(glob.glob(item, recursive=True))
+    if listFile is not None:
+        with (sys.stdin if listFile == "-" else open(listFile, encoding="utf-8")) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+# end function
+
+
+def loadDone(outputPath):
+    # Các ảnh đã có kết quả trong file JSONL (để chạy tiếp sau khi bị dừng giữa chừng).
+    # Dòng cuối bị ghi dở (tiến trình bị kill) được bỏ qua, ảnh đó sẽ được xử lý lại
+    done = set()
+    if not os.path.exists(outputPath):
+        return done
+    with open(outputPath, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+# end function
+
+
+def plateRecord(plate):
+    return {"text": plate.text, "first_line": plate.first_line, "second_line": plate.second_line,
+            "quad": plate.quad.tolist(), "angle": round(float(plate.angle), 3),
+            "confidence": round(plate.confidence, 3), "confidences": [round(c, 3) for c in plate.confidences]}
+# end function
+
+
+###################################################################################################
+def initWorker(recognizerOptions, resize):
+    global recognizer, resizeTo
+    cv2.setNumThreads(1)                    # mỗi worker 1 core, tránh tranh chấp thread của OpenCV
+    recognizer = LicensePlateRecognizer(**recognizerOptions)
+    resizeTo = resize
+# end function
+
+
+def recognizeFile(path):
+    # Chạy trong worker: đọc, giải mã, nhận dạng 1 ảnh, trả về 1 bản ghi JSON (dạng dict)
+    start = time.perf_counter()
+    try:
+        img = cv2.imread(path)
+        if img is None:
+            return {"path": path, "error": "cannot read image"}
+        (height, width) = img.shape[:2]
+        if resizeTo is not None:
+            img = cv2.resize(img, dsize=resizeTo)
+        decoded = time.perf_counter()
+        plates = recognizer.recognize(img)
+        end = time.perf_counter()
+    except Exception as e:
+        return {"path": path, "error": "%s: %s" % (type(e).__name__, e)}
+    return {"path": path, "width": width, "height": height, "plates": [plateRecord(p) for p in plates],
+            "decode_ms": round(1e3 * (decoded - start), 2), "recognize_ms": round(1e3 * (end - decoded), 2)}
+# end function
+
+
+def runBatch(paths, workers=None, recognizerOptions=None, resize=None, chunkSize=CHUNK_SIZE):
+    # Trả về lần lượt các bản ghi theo thứ tự xử lý xong (không theo thứ tự đầu vào).
+    # workers=0: chạy trong tiến trình hiện tại
+    recognizerOptions = recognizerOptions or {}
+    if workers == 0:
+        initWorker(recognizerOptions, resize)
+        for path in paths:
+            yield recognizeFile(path)
+        return
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers or os.cpu_count() or 1, initWorker, (recognizerOptions, resize)) as pool:
+        yield from pool.imap_unordered(recognizeFile, paths, chunkSize)
+# end function
+
+
+###################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Headless license plate recognition over many images, JSONL output")
+    parser.add_argument("inputs", nargs="*", help="image files, directories (searched recursively) or globs")
+    parser.add_argument("--list", default=None, help="file with one image path per line, - for stdin")
+    parser.add_argument("--output", "-o", default="results.jsonl", help="JSONL file, appended to")
+    parser.add_argument("--no-resume", action="store_true", help="process images already in the output again")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="recognition processes, 0 = serial")
+    parser.add_argument("--resize", type=int, nargs=2, metavar=("W", "H"), default=None,
+                        help="resize every image first, e.g. 1920 1080 like Image_test2.py")
+    parser.add_argument("--model", default=ModelStore.MODEL_FILE, help="compiled KNN model")
+    parser.add_argument("--backend", choices=KnnEngine.BACKENDS, default="opencv", help="KNN backend")
+    parser.add_argument("--detect-scale", type=float, default=None, help="see VideoPipeline.py")
+    parser.add_argument("--roi", type=int, nargs=4, metavar=("X", "Y", "W", "H"), default=None)
+    parser.add_argument("--plate-cache", action="store_true",
+                        help="reuse the reading of a near-identical plate crop instead of running OCR again")
+    parser.add_argument("--cache-tolerance", type=int, default=PlateCache.TOLERANCE, help="Hamming distance in bits")
+    parser.add_argument("--cache-ttl", type=float, default=PlateCache.TTL, help="seconds before a reading is redone")
+    parser.add_argument("--classifier", default=None, help="ONNX character CNN from TrainCnn.py, default: KNN")
+    parser.add_argument("--classifier-engine", choices=CharClassifier.ENGINES, default="opencv",
+                        help="runtime for --classifier")
+    args = parser.parse_args()
+    if not args.inputs and args.list is None:
+        parser.error("no input images given")
+
+    done = set() if args.no_resume else loadDone(args.output)
+    seen = set()
+    skipped = 0
+
+    def pending():
+        nonlocal skipped
+        for path in iterImages(args.inputs, args.list):
+            if path in done or path in seen:
+                skipped = skipped + 1
+                continue
+            seen.add(path)
+            yield path
+
+    # Nạp (và nếu cần thì biên dịch lại) model ở đây 1 lần: lỗi được báo ngay thay vì mỗi worker tự thử lại mãi,
+    # và các worker không cùng lúc ghi đè knn_model.bin
+    if args.classifier is None:
+        ModelStore.loadModel(args.model)
+    cache = PlateCache.PlateCache(ttl=args.cache_ttl, tolerance=args.cache_tolerance) if args.plate_cache else None
+    options = {"modelPath": os.path.abspath(args.model), "backend": args.backend, "detectScale": args.detect_scale,
+               "roi": args.roi, "cache": cache,
+               "classifier": os.path.abspath(args.classifier) if args.classifier else None,
+               "classifierEngine": args.classifier_engine}
+    count = 0
+    errors = 0
+    start = time.perf_counter()
+    if os.path.exists(args.output):
+        with open(args.output, "rb+") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")          # dòng cuối bị ghi dở từ lần chạy trước
+    with open(args.output, "a", encoding="utf-8") as out:
+        for record in runBatch(pending(), args.workers, options, tuple(args.resize) if args.resize else None):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            count = count + 1
+            errors = errors + ("error" in record)
+            if count % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - start
+                print("%d images, %.1f images/sec" % (count, count / elapsed), file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print("%d images in %.2f s, %.1f images/sec with %d workers (%d errors, %d skipped as already done)"
+          % (count, elapsed, count / elapsed if elapsed > 0 else 0.0, args.workers, errors, skipped))
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,585 @@
+# Benchmark.py
+
+import argparse
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import CharClassifier
+import Detection
+import Geometry
+import KnnEngine
+import ModelCompact
+import ModelStore
+import Preprocess
+import TrainCnn
+from GeometryReference import (DEFAULT_IMAGES, DEGENERATE_QUADS, FRAME_SIZE, filterQuadsReference, loadFrames,
+                               plateAngleReference, tiltedFrames)
+from PlateCache import TOLERANCE, PlateCache
+from Recognizer import (CASCADE_STAGES, KNN_K, LicensePlateRecognizer, cropPlate, fillCharacters,
+                        findPlateCandidates, flattenCharacter, plateAngle, rejectStage)
+
+# module level variables ##########################################################################
+BATCH_SIZES = (1, 9, 90, 1000)  # 1 ký tự, 1 biển số, 1 frame nhiều biển số, cả tập giữ lại
+
+
+###################################################################################################
+def peakAllocation(fn):
+    # Lượng bộ nhớ cấp phát lớn nhất trong 1 lần gọi (numpy và các mảng OpenCV trả về đều được tracemalloc đếm)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+# end function
+
+
+def bestOf(fn, repeat):
+    # Thời gian nhỏ nhất của nhiều lần chạy, ít bị nhiễu bởi các tiến trình khác
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+# end function
+
+
+###################################################################################################
+def benchKnn(args):
+    # So sánh gọi findNearest cho từng ký tự với gọi 1 lần cho cả frame
+    recognizer = LicensePlateRecognizer(backend=args.backend)
+    perFrame = []
+    for path, img in loadFrames(args.images):
+        imgThreshplate, candidates = recognizer.detect(img)
+        pendings = [p for p in (recognizer.preparePlate(img, imgThreshplate, c) for c in candidates) if p is not None]
+        if pendings:
+            perFrame.append(pendings)
+    nChars = sum(len(p.boxes) for pendings in perFrame for p in pendings)
+    if nChars == 0:
+        print("no characters found in", args.images)
+        return
+
+    def perCharacter():
+        for pendings in perFrame:
+            for pending in pendings:
+                for box in pending.boxes:
+                    recognizer.kNearest.findNearest(flattenCharacter(pending.thre_mor, box), k=KNN_K)
+
+    def batched():
+        for pendings in perFrame:
+            start = 0
+            for pending in pendings:
+                start += fillCharacters(pending.thre_mor, pending.boxes, recognizer.npaBatch[start:])
+            recognizer.kNearest.findNearest(recognizer.npaBatch[:start], k=KNN_K)
+
+    single = bestOf(perCharacter, args.repeat)
+    batch = bestOf(batched, args.repeat)
+    print("frames with plates: %d, characters: %d" % (len(perFrame), nChars))
+    print("per-character findNearest: %8.1f us/char" % (1e6 * single / nChars))
+    print("batched findNearest:       %8.1f us/char" % (1e6 * batch / nChars))
+    print("speed-up:                  %8.2fx" % (single / batch))
+# end function
+
+
+def collectCharacters(pattern):
+    # Ma trận các ký tự thật tách từ ảnh mẫu, dùng làm truy vấn cho KNN
+    recognizer = LicensePlateRecognizer()
+    rows = []
+    for path, img in loadFrames(pattern):
+        imgThreshplate, candidates = recognizer.detect(img)
+        for screenCnt in candidates:
+            pending = recognizer.preparePlate(img, imgThreshplate, screenCnt)
+            if pending is not None:
+                rows.append(np.concatenate([flattenCharacter(pending.thre_mor, box) for box in pending.boxes]))
+    return np.concatenate(rows) if rows else np.empty((0, 600), np.float32)
+# end function
+
+
+def benchKnnBackends(args):
+    # Kiểm tra backend NumPy cho nhãn giống hệt cv2.ml.KNearest rồi so sánh tốc độ theo kích thước lô
+    model = ModelStore.loadModel()
+    rng = np.random.default_rng(0)
+    samples = np.asarray(model.samples, np.float32)
+    queries = {
+        "training samples": samples,
+        "plate characters": collectCharacters(args.images),
+        "noisy samples": np.clip(samples + rng.normal(0, 40, samples.shape), 0, 255).round().astype(np.float32),
+        "random binary": (rng.random((500, samples.shape[1])) > 0.5).astype(np.float32) * 255,
+    }
+
+    reference = KnnEngine.createKNearest(model, "opencv")
+    backends = [("opencv", reference)]
+    for dtype in KnnEngine.STORAGE_DTYPES:
+        backends.append(("numpy/" + dtype, KnnEngine.createKNearest(model, "numpy", dtype)))
+
+    allSame = True
+    for name, npaQueries in queries.items():
+        _, expected, _, _ = reference.findNearest(npaQueries, k=KNN_K)
+        for backendName, kNearest in backends[1:]:
+            _, results, _, _ = kNearest.findNearest(npaQueries, k=KNN_K)
+            same = np.array_equal(results, expected)
+            allSame = allSame and same
+            print("%-18s %-16s %4d queries  labels %s" % (name, backendName, len(npaQueries),
+                                                         "identical" if same else "DIFFER"))
+
+    pool = queries["noisy samples"]
+    print("\n%-16s" % "batch size" + "".join("%16s" % name for name, _ in backends) + "   (us/char)")
+    for batch in (1, 9, 90):
+        npaBatch = np.ascontiguousarray(pool[:batch])
+        row = "%-16d" % batch
+        for name, kNearest in backends:
+            seconds = bestOf(lambda: kNearest.findNearest(npaBatch, k=KNN_K), args.repeat)
+            row += "%16.1f" % (1e6 * seconds / batch)
+        print(row)
+    if not allSame:
+        raise SystemExit("numpy backend disagrees with cv2.ml.KNearest")
+# end function
+
+
+###################################################################################################
+def benchClassifiers(args):
+    # KNN (mặc định) và CNN của TrainCnn.py: độ chính xác trên các ký tự CNN chưa thấy khi huấn luyện (cùng cách chia
+    # của TrainCnn.py, KNN chỉ dùng phần huấn luyện), tỉ lệ đồng ý với KNN trên ký tự thật của ảnh mẫu,
+    # và số ký tự / giây theo kích thước lô
+    cnn = CharClassifier.CnnClassifier(args.cnn)
+    meta = cnn.info["meta"]
+    model = ModelStore.loadModel(args.model or meta["source"])
+    holdout = meta.get("holdout", {}).get("fraction", 0)
+    if holdout:
+        (trainSamples, trainLabels), (testSamples, testLabels) = ModelCompact.splitHoldout(model, holdout, meta["seed"])
+        print("%s: %d training / %d held-out characters" % (model.path, len(trainLabels), len(testLabels)))
+    else:
+        (trainSamples, trainLabels) = (testSamples, testLabels) = (np.asarray(model.samples, np.float32), model.labels)
+        print("%s: the CNN was trained on every character, accuracy is measured on the training set" % model.path)
+    trainModel = ModelStore.KnnModel(trainSamples, trainLabels)
+
+    classifiers = [("knn opencv", CharClassifier.KnnClassifier(KnnEngine.createKNearest(trainModel, "opencv"), KNN_K)),
+                   ("knn numpy", CharClassifier.KnnClassifier(KnnEngine.createKNearest(trainModel, "numpy"), KNN_K)),
+                   ("cnn opencv", cnn)]
+    try:
+        classifiers.append(("cnn onnxruntime", CharClassifier.CnnClassifier(args.cnn, "onnxruntime")))
+    except ValueError as error:
+        print("skipping cnn onnxruntime:", error)
+
+    plateChars = collectCharacters(args.images)
+    truth = [chr(int(code)) for code in testLabels.reshape(-1)]
+    reference = classifiers[0][1].classify(plateChars)[0]
+    pool = np.ascontiguousarray(np.concatenate([plateChars, testSamples])[:max(BATCH_SIZES)], np.float32)
+    print("%-16s %9s %11s" % ("classifier", "accuracy", "agree/knn") +
+          "".join("%12s" % ("batch %d" % b) for b in BATCH_SIZES) + "   (chars/sec)")
+    for name, classifier in classifiers:
+        chars, _ = classifier.classify(testSamples)
+        accuracy = np.mean([a == b for a, b in zip(chars, truth)])
+        agree = np.mean([a == b for a, b in zip(classifier.classify(plateChars)[0], reference)]) if len(plateChars) else 0
+        row = "%-16s %8.2f%% %10.1f%%" % (name, 100 * accuracy, 100 * agree)
+        for batch in BATCH_SIZES:
+            npaBatch = pool[:batch]
+            row += "%12.0f" % (len(npaBatch) / bestOf(lambda: classifier.classify(npaBatch), args.repeat))
+        print(row)
+    print("agree/knn: same label as knn opencv on the %d characters cut from %s" % (len(plateChars), args.images))
+# end function
+
+
+###################################################################################################
+def preprocessReference(imgOriginal):
+    # Preprocess.preprocess trước khi có maximizeContrastFast và extractValue không qua HSV, giữ lại để so sánh
+    imgGrayscale = cv2.split(cv2.cvtColor(imgOriginal, cv2.COLOR_BGR2HSV))[2]
+    imgMaxContrastGrayscale = Preprocess.maximizeContrast(imgGrayscale)
+    imgBlurred = cv2.GaussianBlur(imgMaxContrastGrayscale, Preprocess.GAUSSIAN_SMOOTH_FILTER_SIZE, 0)
+    imgThresh = cv2.adaptiveThreshold(imgBlurred, 255.0, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
+                                      Preprocess.ADAPTIVE_THRESH_BLOCK_SIZE, Preprocess.ADAPTIVE_THRESH_WEIGHT)
+    return imgGrayscale, imgThresh
+# end function
+
+
+def benchPreprocess(args):
+    # maximizeContrast cũ và mới: kiểm tra giống hệt từng điểm ảnh rồi đo thời gian
+    frames = loadFrames(args.images)
+    rng = np.random.default_rng(0)
+    grays = [("%s" % path, Preprocess.extractValue(img)) for path, img in frames]
+    grays += [("random %dx%d" % shape[::-1], rng.integers(0, 256, shape, dtype=np.uint8))
+              for shape in [(1080, 1920), (37, 53), (7, 5), (1, 1)]]
+
+    for name, gray in grays:
+        if not np.array_equal(Preprocess.maximizeContrast(gray), Preprocess.maximizeContrastFast(gray)):
+            raise SystemExit("maximizeContrastFast differs from maximizeContrast on " + name)
+    for path, img in frames:
+        if not all(np.array_equal(a, b) for a, b in zip(preprocessReference(img), Preprocess.preprocess(img))):
+            raise SystemExit("preprocess differs from the reference path on " + path)
+    print("%d images: maximizeContrastFast and preprocess are pixel-identical to the old path" % len(grays))
+    if not frames:
+        return
+
+    gray = grays[0][1]
+    img = frames[0][1]
+    rows = [
+        ("maximizeContrast (3x3 x 10)", lambda: Preprocess.maximizeContrast(gray)),
+        ("maximizeContrastFast (21x21)", lambda: Preprocess.maximizeContrastFast(gray)),
+        ("preprocess, old path", lambda: preprocessReference(img)),
+        ("preprocess", lambda: Preprocess.preprocess(img)),
+        ("preprocess from V channel", lambda: Preprocess.preprocess(gray)),
+    ]
+    print("%dx%d frame:" % (gray.shape[1], gray.shape[0]))
+    for name, fn in rows:
+        print("%-32s %8.2f ms" % (name, 1e3 * bestOf(fn, args.repeat)))
+# end function
+
+
+###################################################################################################
+def cropPlateMasked(img, imgThreshplate, screenCnt, angle):
+    # Cách cắt biển số cũ của Image_test2.py / Video_test2.py: mask cả frame + np.where, giữ lại để so sánh
+    mask = np.zeros(imgThreshplate.shape, np.uint8)
+    cv2.drawContours(mask, [screenCnt], 0, 255, -1, )
+
+    (x, y) = np.where(mask == 255)
+    (topx, topy) = (np.min(x), np.min(y))
+    (bottomx, bottomy) = (np.max(x), np.max(y))
+
+    roi = img[topx:bottomx + 1, topy:bottomy + 1]
+    imgThresh = imgThreshplate[topx:bottomx + 1, topy:bottomy + 1]
+
+    ptPlateCenter = (bottomx - topx) / 2, (bottomy - topy) / 2
+    rotationMatrix = cv2.getRotationMatrix2D(ptPlateCenter, angle, 1.0)
+
+    roi = cv2.warpAffine(roi, rotationMatrix, (bottomy - topy, bottomx - topx))
+    imgThresh = cv2.warpAffine(imgThresh, rotationMatrix, (bottomy - topy, bottomx - topx))
+
+    roi = cv2.resize(roi, (0, 0), fx=3, fy=3)
+    imgThresh = cv2.resize(imgThresh, (0, 0), fx=3, fy=3)
+    return roi, imgThresh
+# end function
+
+
+def benchCrop(args):
+    # Chi phí cắt + xoay + phóng to cho mỗi ứng viên biển số, trước và sau khi bỏ mask cả frame
+    cases = []
+    for path, img in loadFrames(args.images):
+        imgGrayscaleplate, imgThreshplate = Preprocess.preprocess(img)
+        for screenCnt in findPlateCandidates(imgThreshplate):
+            cases.append((img, imgThreshplate, screenCnt, plateAngle(screenCnt)))
+    if not cases:
+        print("no plate candidates found in", args.images)
+        return
+
+    for img, imgThreshplate, screenCnt, angle in cases:
+        _, expected = cropPlateMasked(img, imgThreshplate, screenCnt, angle)
+        _, imgThresh = cropPlate(None, imgThreshplate, screenCnt, angle)
+        if not np.array_equal(expected, imgThresh):
+            raise SystemExit("cropPlate output differs from the masked crop")
+
+    variants = [
+        ("full-frame mask + np.where", lambda c: cropPlateMasked(*c)),
+        ("bounding rect, colour + thresh", lambda c: cropPlate(*c)),
+        ("bounding rect, thresh only", lambda c: cropPlate(None, *c[1:])),
+    ]
+    print("%d candidates from %s, outputs identical" % (len(cases), args.images))
+    for name, fn in variants:
+        seconds = bestOf(lambda: [fn(c) for c in cases], args.repeat)
+        peak = np.median([peakAllocation(lambda: fn(c)) for c in cases])
+        print("%-32s %8.1f us/candidate   median peak alloc %7.1f KB" % (name, 1e6 * seconds / len(cases), peak / 1024))
+# end function
+
+
+###################################################################################################
+def placeOnCanvas(img, size, feather=64):
+    # Giả lập camera góc rộng độ phân giải cao: đặt frame vào giữa 1 nền lớn hơn, nền là chính frame đó
+    # phóng to và làm mờ (đường, trời không có cạnh rõ), viền frame được làm mềm để không tạo thêm contour
+    (width, height) = size
+    (h, w) = img.shape[:2]
+    background = cv2.resize(img, (width // 16, height // 16), interpolation=cv2.INTER_AREA)
+    background = cv2.resize(cv2.GaussianBlur(background, (0, 0), 4), size).astype(np.float32)
+    alpha = np.zeros((h, w), np.float32)
+    alpha[feather:-feather, feather:-feather] = 1
+    alpha = cv2.GaussianBlur(alpha, (0, 0), feather / 2)[:, :, None]
+    (x0, y0) = ((width - w) // 2, (height - h) // 2)
+    window = background[y0:y0 + h, x0:x0 + w]
+    window[:] = alpha * img + (1 - alpha) * window
+    return background.astype(np.uint8)
+# end function
+
+
+def quadKeys(candidates):
+    return {tuple(map(tuple, c.reshape(4, 2).tolist())) for c in candidates}
+# end function
+
+
+def insideRoi(screenCnt, roi):
+    (x, y, w, h) = cv2.boundingRect(screenCnt)
+    (rx, ry, rw, rh) = roi
+    return rx <= x and ry <= y and x + w <= rx + rw and y + h <= ry + rh
+# end function
+
+
+def benchDetect(args):
+    # So sánh tìm biển số trên cả frame với chế độ nhiều tỉ lệ / vùng ROI: thời gian và các contour 4 cạnh bị mất
+    frames = loadFrames(args.images)
+    if args.canvas:
+        frames = [(path, placeOnCanvas(img, tuple(args.canvas))) for path, img in frames]
+    if not frames:
+        print("no images found in", args.images)
+        return
+
+    modes = [("multi-scale %g" % scale, scale, None) for scale in args.scale]
+    if args.roi:
+        modes.append(("roi %d,%d %dx%d" % tuple(args.roi), None, tuple(args.roi)))
+        modes += [("roi + multi-scale %g" % scale, scale, tuple(args.roi)) for scale in args.scale]
+
+    reference = [(img, quadKeys(Detection.detectPlates(img)[1])) for _, img in frames]
+    full = bestOf(lambda: [Detection.detectPlates(img) for img, _ in reference], args.repeat)
+    size = frames[0][1].shape
+    print("%d frames of %dx%d, %d quads on the full frame" % (len(frames), size[1], size[0],
+                                                              sum(len(q) for _, q in reference)))
+    print("%-28s %9.1f ms/frame" % ("full frame", 1e3 * full / len(frames)))
+    for name, scale, roi in modes:
+        lost = 0
+        expected = 0
+        for img, quads in reference:
+            if roi is not None:
+                quads = {q for q in quads if insideRoi(np.array(q), roi)}
+            expected += len(quads)
+            lost += len(quads - quadKeys(Detection.detectPlates(img, scale, roi)[1]))
+        seconds = bestOf(lambda: [Detection.detectPlates(img, scale, roi) for img, _ in reference], args.repeat)
+        print("%-28s %9.1f ms/frame  %5.2fx   quads lost %d of %d" % (name, 1e3 * seconds / len(frames),
+                                                                      full / seconds, lost, expected))
+# end function
+
+
+###################################################################################################
+def benchGeometry(args):
+    # Geometry.py: cùng quyết định giữ / bỏ với vòng lặp cũ trên ảnh mẫu, cùng ảnh biển số sau khi xoay,
+    # các trường hợp suy biến, rồi thời gian lọc + tính góc cho cả frame (test_geometry.py kiểm tra giống vậy)
+    frames = tiltedFrames(loadFrames(args.images))
+    if not frames:
+        print("no images found in", args.images)
+        return
+    cases = []
+    for path, img in frames:
+        imgGrayscaleplate, imgThreshplate = Preprocess.preprocess(img)
+        cases.append((path, imgThreshplate, Detection.plateContours(imgThreshplate, args.contours)))
+
+    kept = 0
+    quads = []
+    for path, imgThreshplate, contours in cases:
+        expected = filterQuadsReference(contours)
+        actual = Detection.filterQuads(contours)
+        if len(expected) != len(actual) or not all(np.array_equal(a, b) for a, b in zip(expected, actual)):
+            raise SystemExit("Geometry.filterQuads differs from the old loop on " + path)
+        kept += len(actual)
+        quads += [(imgThreshplate, q.reshape(4, 1, 2)) for q in Geometry.approxQuads(contours)[0]]
+
+    angles = Geometry.plateAngles([q for _, q in quads]) if quads else []
+    changed = 0
+    for (imgThreshplate, screenCnt), angle in zip(quads, angles):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reference = plateAngleReference(screenCnt)
+        if reference == angle:
+            continue
+        changed += 1
+        if not np.array_equal(cropPlate(None, imgThreshplate, screenCnt, reference)[1],
+                              cropPlate(None, imgThreshplate, screenCnt, angle)[1]):
+            raise SystemExit("plate angle %r vs %r changes the deskewed plate" % (reference, float(angle)))
+    print("%d frames, %d contours: same %d quads kept as the old loop" % (len(cases),
+                                                                        sum(len(c) for _, _, c in cases), kept))
+    print("%d 4-sided quads: %d angles differ in the last bits, deskewed plates identical" % (len(quads), changed))
+
+    degenerate = np.array([quad for quad, _ in DEGENERATE_QUADS])
+    angles = Geometry.plateAngles(degenerate).tolist()
+    for (quad, expected), angle in zip(DEGENERATE_QUADS, angles):
+        if expected is None:
+            expected = plateAngleReference(np.array(quad).reshape(4, 1, 2))
+        if not np.isclose(angle, expected):
+            raise SystemExit("degenerate quad %s: angle %r, expected %r" % (quad, angle, expected))
+    print("degenerate quads: angles %s" % [round(a, 2) for a in angles])
+
+    contourLists = [contours for _, _, contours in cases]
+    rows = [
+        ("filterQuads, old loop", lambda: [filterQuadsReference(c) for c in contourLists]),
+        ("filterQuads, Geometry", lambda: [Detection.filterQuads(c) for c in contourLists]),
+        ("plateAngle per quad, old", lambda: [plateAngleReference(q) for _, q in quads]),
+        ("plateAngles, one batch", lambda: Geometry.plateAngles([q for _, q in quads])),
+    ]
+    for name, fn in rows:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            print("%-28s %9.1f us/frame" % (name, 1e6 * bestOf(fn, args.repeat) / len(cases)))
+# end function
+
+
+def benchCascade(args):
+    # Ở độ phân giải gốc của ảnh và ở FRAME_SIZE: số ứng viên mỗi bước của cascade loại được, số biển số thật
+    # (cascade=False đọc ra chữ) bị loại nhầm, và thời gian cắt + tách ký tự cho tất cả ứng viên của 1 frame
+    # khi có và không có cascade
+    full = LicensePlateRecognizer(cascade=False)
+    cascade = LicensePlateRecognizer(model=full.model, cascade=True)
+    lostTotal = 0
+    for title, size in (("native resolution", None), ("%dx%d" % FRAME_SIZE, FRAME_SIZE)):
+        cases = []
+        for path, img in loadFrames(args.images, size):
+            imgThreshplate, candidates = full.detect(img)
+            cases.append((path, img, imgThreshplate, candidates))
+        if not cases:
+            print("no images found in", args.images)
+            return
+
+        killed = dict.fromkeys(CASCADE_STAGES, 0)
+        total = 0
+        plates = 0
+        lost = []
+        for path, img, imgThreshplate, candidates in cases:
+            for screenCnt in candidates:
+                total = total + 1
+                stage = rejectStage(imgThreshplate, screenCnt)
+                plate = full.readPlate(img, imgThreshplate, screenCnt)
+                if plate is not None:
+                    plates = plates + 1
+                    if stage is not None:
+                        lost.append("%s: %s rejected by the %s stage" % (path, plate.text, stage))
+                elif stage is not None:
+                    killed[stage] += 1
+
+        print("%s: %d frames, %d candidates, %d plates read without the cascade" % (title, len(cases), total, plates))
+        for stage in CASCADE_STAGES:
+            print("%-28s rejects %4d" % (stage, killed[stage]))
+        print("%-28s %4d of %d false candidates" % ("total rejected early", sum(killed.values()), total - plates))
+        print("%-28s %4d of %d" % ("true plates lost", len(lost), plates))
+        for line in lost:
+            print("  " + line)
+        lostTotal += len(lost)
+        for name, recognizer in (("without cascade", full), ("with cascade", cascade)):
+            seconds = bestOf(lambda: [recognizer.preparePlate(img, t, c) for _, img, t, cands in cases for c in cands],
+                             args.repeat)
+            print("%-28s %8.2f ms/frame" % (name, 1e3 * seconds / len(cases)))
+    if lostTotal:
+        raise SystemExit("the cascade rejects %d plates that are read without it" % lostTotal)
+# end function
+
+
+def benchCache(args):
+    # Cùng các frame được đưa vào nhiều lần (xe đỗ / ảnh lặp lại): thời gian cắt + tách ký tự + KNN cho mỗi frame
+    # khi không có cache, và khi đã có kết quả trong PlateCache; kết quả đọc phải giống hệt
+    full = LicensePlateRecognizer()
+    cached = LicensePlateRecognizer(model=full.model, cache=PlateCache(tolerance=args.tolerance))
+    cases = [(img,) + full.detect(img) for _, img in loadFrames(args.images)]
+    if not cases:
+        print("no images found in", args.images)
+        return
+
+    def readAll(recognizer):
+        results = []
+        for img, imgThreshplate, candidates in cases:
+            pendings = [recognizer.preparePlate(img, imgThreshplate, c) for c in candidates]
+            results.append([(p.text, p.quad.tolist(), p.angle)
+                            for p in recognizer.readPlates([p for p in pendings if p is not None])])
+        return results
+
+    # Lần 1 toàn miss (ghi vào cache), lần 2 toàn hit: cả 2 phải đọc giống hệt pipeline đầy đủ
+    expected = readAll(full)
+    if readAll(cached) != expected:
+        raise SystemExit("cached readings differ from the full pipeline on the cold pass")
+    misses = cached.cache.misses
+    if readAll(cached) != expected:
+        raise SystemExit("cached readings differ from the full pipeline on the warm pass")
+    if cached.cache.misses != misses:
+        raise SystemExit("warm pass missed the cache %d times" % (cached.cache.misses - misses))
+    print("%d frames, %d cached results, readings identical on the cold and warm pass"
+          % (len(cases), len(cached.cache)))
+    base = bestOf(lambda: readAll(full), args.repeat)
+    seconds = bestOf(lambda: readAll(cached), args.repeat)
+    print("%-28s %8.2f ms/frame" % ("without cache", 1e3 * base / len(cases)))
+    print("%-28s %8.2f ms/frame  %5.2fx   hit rate %.2f" % ("with cache", 1e3 * seconds / len(cases), base / seconds,
+                                                              cached.cache.hitRate()))
+# end function
+
+
+def recognizeRss(path, pooled, count):
+    # Chạy trong 1 tiến trình mới để các lần đo không ảnh hưởng nhau: RSS lớn nhất (KB) và số page fault mỗi frame.
+    # Mảng cỡ frame được malloc cấp bằng mmap và trả lại ngay khi giải phóng, nên RSS gần như không đổi
+    # nhưng mỗi frame phải page fault lại toàn bộ vùng nhớ mới
+    recognizer = LicensePlateRecognizer()
+    if not pooled:
+        recognizer.buffers = None
+    img = cv2.resize(cv2.imread(path), dsize=FRAME_SIZE)
+    recognizer.recognize(img)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    for _ in range(count):
+        recognizer.recognize(img)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    return after.ru_maxrss, (after.ru_minflt - before.ru_minflt) / float(count)
+# end function
+
+
+def benchBuffers(args):
+    # Cấp phát mới mọi ảnh trung gian mỗi frame và dùng lại BufferPool: kết quả phải giống hệt,
+    # so sánh thời gian, bộ nhớ cấp phát lớn nhất trong 1 frame (tracemalloc) và RSS lớn nhất
+    frames = loadFrames(args.images)
+    if not frames:
+        print("no images found in", args.images)
+        return
+    recognizer = LicensePlateRecognizer()
+    pool = recognizer.buffers
+    for path, img in frames:
+        expected = recognizer.detect(img)
+        actual = recognizer.detect(img, None, pool)
+        if not np.array_equal(expected[0], actual[0]) or quadKeys(expected[1]) != quadKeys(actual[1]):
+            raise SystemExit("pooled detection differs on " + path)
+    print("%d frames, pooled detection identical; pool holds %d buffers, %.1f MB, %d allocations"
+          % (len(frames), len(pool.memory), pool.nbytes() / 2 ** 20, pool.allocations))
+
+    context = multiprocessing.get_context("spawn")
+    for name, pooled in (("allocate every frame", False), ("BufferPool", True)):
+        recognizer.buffers = pool if pooled else None
+        seconds = bestOf(lambda: [recognizer.recognize(img) for _, img in frames], args.repeat)
+        peak = np.median([peakAllocation(lambda: recognizer.recognize(img)) for _, img in frames])
+        with context.Pool(1) as workers:
+            maxRss, faults = workers.apply(recognizeRss, (frames[0][0], pooled, 4 * args.repeat))
+        print("%-22s %8.2f ms/frame   median peak alloc %6.1f MB   max RSS %6.1f MB   %7.0f page faults/frame"
+              % (name, 1e3 * seconds / len(frames), peak / 2 ** 20, maxRss / 1024, faults))
+# end function
+
+
+###################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the license plate pipeline")
+    parser.add_argument("--images", default=DEFAULT_IMAGES, help="glob of input images")
+    parser.add_argument("--repeat", type=int, default=20, help="number of timed runs, the best one is reported")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    knn = sub.add_parser("knn", help="per-character vs batched KNN classification")
+    knn.add_argument("--backend", choices=KnnEngine.BACKENDS, default="opencv")
+    knn.set_defaults(func=benchKnn)
+    sub.add_parser("preprocess", help="old vs. fast maximizeContrast").set_defaults(func=benchPreprocess)
+    sub.add_parser("crop", help="plate extraction cost per candidate").set_defaults(func=benchCrop)
+    detect = sub.add_parser("detect", help="full-frame vs. multi-scale / ROI plate detection")
+    detect.add_argument("--scale", type=float, nargs="*", default=[0.25, 0.125], help="coarse pyramid scales")
+    detect.add_argument("--roi", type=int, nargs=4, metavar=("X", "Y", "W", "H"), default=None)
+    detect.add_argument("--canvas", type=int, nargs=2, metavar=("W", "H"), default=None,
+                        help="place each frame inside a larger blurred frame, e.g. 3840 2160")
+    detect.set_defaults(func=benchDetect)
+    geometry = sub.add_parser("geometry", help="old vs. vectorized quad filtering and plate angles")
+    geometry.add_argument("--contours", type=int, default=100, help="largest contours kept per frame")
+    geometry.set_defaults(func=benchGeometry)
+    sub.add_parser("cascade", help="early rejection of plate candidates before deskew and segmentation").set_defaults(
+        func=benchCascade)
+    cache = sub.add_parser("cache", help="plate result cache on repeated frames")
+    cache.add_argument("--tolerance", type=int, default=TOLERANCE, help="Hamming distance in bits")
+    cache.set_defaults(func=benchCache)
+    sub.add_parser("buffers", help="per-frame allocations vs. a reused BufferPool").set_defaults(func=benchBuffers)
+    sub.add_parser("knn-backends", help="validate and time the NumPy KNN backend against OpenCV").set_defaults(
+        func=benchKnnBackends)
+    classifiers = sub.add_parser("classifiers", help="KNN vs. the CNN of TrainCnn.py: accuracy and chars/sec")
+    classifiers.add_argument("--cnn", default=TrainCnn.CNN_FILE, help="ONNX file written by TrainCnn.py")
+    classifiers.add_argument("--model", default=None,
+                             help="character model the CNN was trained on, default: the one recorded by TrainCnn.py")
+    classifiers.set_defaults(func=benchClassifiers)
+
+    args = parser.parse_args()
+    args.func(args)
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,93 @@
+# CharClassifier.py
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+# module level variables ##########################################################################
+ENGINES = ("opencv", "onnxruntime")     # chạy CNN bằng cv2.dnn (mặc định, không cần cài thêm) hoặc onnxruntime
+CNN_INPUT = "chars"                     # tên đầu vào / đầu ra của đồ thị ONNX do TrainCnn.py ghi ra
+CNN_OUTPUT = "probabilities"
+
+
+###################################################################################################
+class KnnClassifier:
+    # Bộ phân loại mặc định: KNN trên 600 điểm ảnh (cv2.ml.KNearest hoặc KnnEngine.NumpyKNearest).
+    # Mọi bộ phân loại có cùng hàm classify(npaBatch) -> (chars, confidences) với npaBatch là ma trận (N, 600)
+    # float32 các ký tự đã làm phẳng bởi flattenCharacter / fillCharacters
+    def __init__(self, kNearest, k):
+        self.kNearest = kNearest
+        self.k = k
+
+    def classify(self, npaBatch):
+        # 1 lần gọi findNearest cho cả lô ký tự, độ tin cậy = tỉ lệ hàng xóm đồng ý
+        _, npaResults, neigh_resp, dists = self.kNearest.findNearest(npaBatch, k=self.k)
+        chars = [chr(int(code)) for code in npaResults[:, 0]]  # ASCII of characters
+        confidences = (np.count_nonzero(neigh_resp == npaResults, axis=1) / self.k).tolist()
+        return chars, confidences
+# end class
+
+
+###################################################################################################
+def sidecarPath(path):
+    # Nhãn và kích thước đầu vào của CNN nằm trong file .json cạnh file .onnx (cv2.dnn không đọc metadata ONNX)
+    return os.path.splitext(path)[0] + ".json"
+# end function
+
+
+class CnnClassifier:
+    # CNN nhỏ do TrainCnn.py huấn luyện, chạy cả lô ký tự của 1 frame qua 1 lần forward trên CPU.
+    # Độ tin cậy = xác suất softmax của nhãn được chọn.
+    # Mỗi recognizer / thread giữ 1 đối tượng riêng (cv2.dnn.Net không dùng chung giữa các thread được)
+    def __init__(self, path, engine="opencv"):
+        if engine not in ENGINES:
+            raise ValueError("unknown CNN engine %r, expected one of %s" % (engine, ", ".join(ENGINES)))
+        with open(sidecarPath(path)) as f:
+            self.info = json.load(f)
+        self.path = path
+        self.engine = engine
+        self.labels = list(self.info["labels"])
+        (self.height, self.width) = self.info["input"]
+        self.scale = np.float32(self.info["scale"])
+        self.net = None
+        self.session = None
+        if engine == "opencv":
+            self.net = cv2.dnn.readNetFromONNX(path)
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        else:
+            try:
+                import onnxruntime
+            except ImportError:
+                raise ValueError("engine 'onnxruntime' needs the onnxruntime package (pip install onnxruntime)")
+            self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def probabilities(self, npaBatch):
+        blob = np.multiply(npaBatch, self.scale, dtype=np.float32).reshape(-1, 1, self.height, self.width)
+        if self.net is not None:
+            self.net.setInput(blob)
+            return self.net.forward()
+        return self.session.run([CNN_OUTPUT], {CNN_INPUT: blob})[0]
+
+    def classify(self, npaBatch):
+        if len(npaBatch) == 0:
+            return [], []
+        probabilities = self.probabilities(npaBatch)
+        best = np.argmax(probabilities, axis=1)
+        chars = [self.labels[i] for i in best.tolist()]
+        confidences = probabilities[np.arange(len(best)), best].astype(float).tolist()
+        return chars, confidences
+# end class
+
+
+###################################################################################################
+def createClassifier(classifier, kNearest, k, engine="opencv"):
+    # classifier: None = KNN, đường dẫn file .onnx = CnnClassifier, hoặc 1 đối tượng có hàm classify() dùng luôn
+    if classifier is None:
+        return KnnClassifier(kNearest, k)
+    if isinstance(classifier, str):
+        return CnnClassifier(classifier, engine)
+    return classifier
+# end function
@@ -0,0 +1,157 @@
+# Detection.py
+
+import cv2
+import numpy as np
+
+import Geometry
+import Preprocess
+
+# module level variables ##########################################################################
+MAX_CANDIDATES = 10             # chỉ xét 10 contour có diện tích lớn nhất
+PLATE_RATIOS = Geometry.PLATE_RATIOS   # biển 2 hàng / biển 1 hàng
+
+# Tìm thô trên ảnh thu nhỏ. Đường viền biển số ở độ phân giải thấp thường không còn đủ 4 cạnh,
+# nên chỉ lọc theo kích thước và tỉ lệ (nới rộng) để không bỏ sót biển số mà ảnh gốc tìm được
+COARSE_CANDIDATES = 60
+COARSE_RATIO = (0.5, 8.0)
+COARSE_MIN_SIDE = 40            # cạnh nhỏ nhất (điểm ảnh trên frame gốc) của 1 vùng thô
+COARSE_PAD = 0.25               # nới mỗi vùng thô thêm 25% mỗi phía trước khi tinh chỉnh
+MAX_REGION_FRACTION = 0.5       # các vùng cần tinh chỉnh phủ quá nửa frame thì xử lý cả frame cho nhanh hơn
+
+# Số điểm ảnh xung quanh ảnh hưởng tới 1 điểm của ảnh nhị phân: tophat/blackhat 21x21 (20),
+# Gauss 5x5 (2), adaptive threshold 19x19 (9), Canny + dilate 3x3 (2). Vùng tinh chỉnh được nới thêm
+# lề này nên phần lõi của nó giống hệt khi xử lý cả frame.
+CONTEXT_MARGIN = 40
+
+
+###################################################################################################
+def plateContours(imgThreshplate, maxCandidates=MAX_CANDIDATES, buffers=None):
+    # Canny + dilate rồi lấy các contour có diện tích lớn nhất
+    shape = imgThreshplate.shape
+    canny_image = cv2.Canny(imgThreshplate, 250, 255, edges=Preprocess.poolGet(buffers, "canny", shape))  # Canny Edge
+    kernel = np.ones((3, 3), np.uint8)
+    dilated_image = cv2.dilate(canny_image, kernel, dst=Preprocess.poolGet(buffers, "dilated", shape),
+                               iterations=1)  # Dilation
+
+    contours, hierarchy = cv2.findContours(dilated_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return sorted(contours, key=cv2.contourArea, reverse=True)[:maxCandidates]
+# end function
+
+
+def filterQuads(contours):
+    # Chỉ giữ contour xấp xỉ được bằng 4 cạnh và có tỉ lệ của biển số, lọc cả frame 1 lần (xem Geometry.py)
+    return Geometry.filterQuads(contours, PLATE_RATIOS)
+# end function
+
+
+def findPlateCandidates(imgThreshplate, maxCandidates=MAX_CANDIDATES, buffers=None):
+    return filterQuads(plateContours(imgThreshplate, maxCandidates, buffers))
+# end function
+
+
+###################################################################################################
+def coarseRegions(frame, scale, buffers=None):
+    # Tìm vùng có thể chứa biển số trên ảnh thu nhỏ, trả về hình chữ nhật (x, y, w, h) trên frame gốc
+    small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    _, imgThresh = Preprocess.preprocess(small, buffers)
+    contours = plateContours(imgThresh, COARSE_CANDIDATES, buffers)
+
+    rects = []
+    for c in contours:
+        [x, y, w, h] = cv2.boundingRect(c)
+        if min(w, h) >= COARSE_MIN_SIDE * scale and COARSE_RATIO[0] <= w / h <= COARSE_RATIO[1]:
+            rects.append((x / scale, y / scale, w / scale, h / scale))
+    return rects
+# end function
+
+
+def expandRect(rect, pad, margin, width, height):
+    # Nới hình chữ nhật thêm pad (tỉ lệ) + margin (điểm ảnh), cắt theo biên frame; trả về (x0, y0, x1, y1)
+    (x, y, w, h) = rect
+    x0 = int(max(0, x - w * pad - margin))
+    y0 = int(max(0, y - h * pad - margin))
+    x1 = int(min(width, x + w * (1 + pad) + margin + 1))
+    y1 = int(min(height, y + h * (1 + pad) + margin + 1))
+    return x0, y0, x1, y1
+# end function
+
+
+def mergeRegions(regions):
+    # Gộp các vùng chồng lên nhau để không xử lý 1 điểm ảnh 2 lần
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+# end function
+
+
+###################################################################################################
+def detectInRegions(frame, regions, margin=CONTEXT_MARGIN, bounds=None, buffers=None):
+    # Tiền xử lý và tìm biển số chỉ trong các vùng (x0, y0, x1, y1). Ảnh nhị phân trả về có kích thước
+    # cả frame (ngoài các vùng là 0) để các bước cắt biển số phía sau dùng toạ độ frame như cũ.
+    # Biển số chạm vào phần lề (không phải mép frame / mép bounds) của vùng bị bỏ vì ảnh nhị phân ở đó chưa chính xác
+    height, width = frame.shape[:2]
+    (bx0, by0, bx1, by1) = bounds if bounds is not None else (0, 0, width, height)
+    if buffers is not None:
+        imgThreshplate = buffers.zeros("canvas", (height, width))
+    else:
+        imgThreshplate = np.zeros((height, width), np.uint8)
+    candidates = []
+    for (x0, y0, x1, y1) in regions:
+        _, imgThresh = Preprocess.preprocess(frame[y0:y1, x0:x1], buffers)
+        ix0 = x0 if x0 == bx0 else x0 + margin
+        iy0 = y0 if y0 == by0 else y0 + margin
+        ix1 = x1 if x1 == bx1 else x1 - margin
+        iy1 = y1 if y1 == by1 else y1 - margin
+        if ix1 <= ix0 or iy1 <= iy0:
+            continue
+        imgThreshplate[iy0:iy1, ix0:ix1] = imgThresh[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0]
+
+        for screenCnt in findPlateCandidates(imgThresh, buffers=buffers):
+            screenCnt = screenCnt + np.array([x0, y0], screenCnt.dtype)
+            (x, y, w, h) = cv2.boundingRect(screenCnt)
+            if ix0 <= x and iy0 <= y and x + w <= ix1 and y + h <= iy1:
+                candidates.append(screenCnt)
+    return imgThreshplate, candidates
+# end function
+
+
+def detectPlates(frame, scale=None, roi=None, margin=CONTEXT_MARGIN, buffers=None):
+    # scale=None, roi=None: như cũ, xử lý cả frame.
+    # roi=(x, y, w, h): chỉ xử lý vùng cố định này của camera.
+    # scale (vd 0.25): tìm thô trên ảnh thu nhỏ rồi chỉ tinh chỉnh các vùng tìm được ở độ phân giải gốc.
+    # buffers: Preprocess.BufferPool của stream; ảnh nhị phân trả về khi đó thuộc về pool, chỉ dùng được tới frame sau
+    height, width = frame.shape[:2]
+    if scale is None and roi is None:
+        _, imgThreshplate = Preprocess.preprocess(frame, buffers)
+        return imgThreshplate, findPlateCandidates(imgThreshplate, buffers=buffers)
+
+    bounds = (0, 0, width, height)
+    if roi is not None:
+        (x, y, w, h) = roi
+        bounds = (max(0, x), max(0, y), min(width, x + w), min(height, y + h))
+    if scale is None:
+        return detectInRegions(frame, [bounds], margin, bounds, buffers)
+
+    (bx0, by0, bx1, by1) = bounds
+    regions = []
+    for rect in coarseRegions(frame[by0:by1, bx0:bx1], scale, buffers):
+        (x0, y0, x1, y1) = expandRect(rect, COARSE_PAD, margin, bx1 - bx0, by1 - by0)
+        regions.append((x0 + bx0, y0 + by0, x1 + bx0, y1 + by0))
+    regions = mergeRegions(regions)
+    covered = sum((x1 - x0) * (y1 - y0) for (x0, y0, x1, y1) in regions)
+    if covered > MAX_REGION_FRACTION * (bx1 - bx0) * (by1 - by0):
+        regions = [bounds]
+    return detectInRegions(frame, regions, margin, bounds, buffers)
+# end function
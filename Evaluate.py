@@ -0,0 +1,229 @@
+# Evaluate.py
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+import CharClassifier
+import KnnEngine
+import ModelStore
+from Benchmark import FRAME_SIZE
+from Metrics import PipelineMetrics
+from Recognizer import LicensePlateRecognizer
+
+# module level variables ##########################################################################
+LABELS_FILE = "data/labels.csv"
+IMAGE_DIR = "data/image"
+STAGES = ("preprocess", "contours", "quad_filter", "cascade", "deskew", "segmentation", "knn")
+PERCENTILES = (50, 90, 99)
+LATENCY_TOLERANCE = 0.25        # --check: chậm hơn baseline quá 25% thì báo lỗi
+
+
+###################################################################################################
+def loadLabels(path=LABELS_FILE, imageDir=IMAGE_DIR):
+    # File CSV "image,plates": tên ảnh và các biển số đọc được bằng mắt (không có "-" và "."), cách nhau bởi dấu cách.
+    # Biển số bị khung hình cắt mất 1 phần thì không ghi
+    labelled = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            labelled.append((os.path.join(imageDir, row["image"]), row["plates"].split()))
+    return labelled
+# end function
+
+
+def loadLabelledFrames(labelled, size=FRAME_SIZE):
+    frames = []
+    for path, plates in labelled:
+        img = cv2.imread(path)
+        if img is None:
+            raise SystemExit("cannot read " + path)
+        frames.append((path, cv2.resize(img, dsize=size), plates))
+    return frames
+# end function
+
+
+def syntheticFrames(frames, count, seed=0):
+    # Frame tổng hợp từ ảnh đã gán nhãn: thu nhỏ nhẹ, xoay, đổi độ sáng / tương phản, thêm nhiễu.
+    # Không phóng to hay dịch chuyển để biển số sát mép ảnh không bị cắt, nhãn vẫn đúng
+    rng = np.random.default_rng(seed)
+    synthetic = []
+    for i in range(count):
+        path, img, plates = frames[i % len(frames)]
+        (h, w) = img.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-4, 4), rng.uniform(0.85, 1.0))
+        out = cv2.warpAffine(img, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+        out = cv2.convertScaleAbs(out, alpha=rng.uniform(0.7, 1.3), beta=rng.uniform(-30, 30))
+        noise = rng.normal(0, rng.uniform(0, 6), out.shape)
+        out = np.clip(out + noise, 0, 255).astype(np.uint8)
+        synthetic.append(("synthetic-%d:%s" % (i, path), out, plates))
+    return synthetic
+# end function
+
+
+###################################################################################################
+def editDistance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+# end function
+
+
+def scoreFrame(predicted, expected):
+    # Mỗi biển số thật ghép với tối đa 1 kết quả đọc giống hệt; ký tự đúng = độ dài - khoảng cách edit
+    # tới kết quả đọc gần nhất (biển số không tìm thấy thì 0 ký tự đúng)
+    remaining = list(predicted)
+    exact = 0
+    for text in expected:
+        if text in remaining:
+            remaining.remove(text)
+            exact = exact + 1
+    chars = 0
+    for text in expected:
+        if predicted:
+            chars += max(0, len(text) - min(editDistance(text, p) for p in predicted))
+    return {"plates": len(expected), "exact": exact, "predictions": len(predicted),
+            "unmatched_predictions": len(remaining), "chars": sum(len(t) for t in expected), "chars_correct": chars}
+# end function
+
+
+def summarize(samples):
+    values = np.asarray(samples) * 1e3
+    summary = {"mean_ms": round(float(values.mean()), 3), "max_ms": round(float(values.max()), 3)}
+    for p in PERCENTILES:
+        summary["p%d_ms" % p] = round(float(np.percentile(values, p)), 3)
+    return summary
+# end function
+
+
+###################################################################################################
+def evaluate(frames, recognizer, repeat=1):
+    # Kết quả đọc và điểm lấy từ lần chạy đầu; thời gian từng bước lấy từ mọi lần chạy (qua Metrics),
+    # thời gian cả frame đo riêng khi đã tắt metrics
+    samples = defaultdict(list)
+
+    def collect(record):
+        for stage in STAGES:
+            samples[stage].append(record.stages.get(stage, 0.0))
+
+    recognizer.metrics = PipelineMetrics(collect)
+    totals = defaultdict(int)
+    failures = []
+    for run in range(repeat):
+        for path, img, expected in frames:
+            plates = recognizer.recognize(img)
+            if run > 0:
+                continue
+            predicted = [p.text for p in plates]
+            score = scoreFrame(predicted, expected)
+            for key, value in score.items():
+                totals[key] += value
+            if score["exact"] < score["plates"] or score["unmatched_predictions"]:
+                failures.append({"image": path, "expected": expected, "predicted": predicted})
+
+    recognizer.metrics = None
+    frameTimes = []
+    for run in range(repeat):
+        for _, img, _ in frames:
+            start = time.perf_counter()
+            recognizer.recognize(img)
+            frameTimes.append(time.perf_counter() - start)
+
+    accuracy = dict(totals)
+    accuracy["plate_recall"] = round(totals["exact"] / totals["plates"], 4) if totals["plates"] else 0.0
+    accuracy["plate_precision"] = round(totals["exact"] / totals["predictions"], 4) if totals["predictions"] else 0.0
+    accuracy["char_accuracy"] = round(totals["chars_correct"] / totals["chars"], 4) if totals["chars"] else 0.0
+    endToEnd = summarize(frameTimes)
+    endToEnd["frames_per_sec"] = round(len(frameTimes) / sum(frameTimes), 2)
+    return {"frames": len(frames), "repeat": repeat, "stages": {s: summarize(samples[s]) for s in STAGES},
+            "end_to_end": endToEnd, "accuracy": accuracy, "failures": failures}
+# end function
+
+
+def checkRegression(report, baseline, tolerance=LATENCY_TOLERANCE):
+    # Độ chính xác không được giảm, thời gian p50 không được chậm hơn baseline quá tolerance
+    problems = []
+    for name in report["sets"]:
+        if name not in baseline.get("sets", {}):
+            continue
+        new, old = report["sets"][name], baseline["sets"][name]
+        for key in ("plate_recall", "plate_precision", "char_accuracy"):
+            if new["accuracy"][key] < old["accuracy"][key]:
+                problems.append("%s %s dropped from %.4f to %.4f" % (name, key, old["accuracy"][key],
+                                                                     new["accuracy"][key]))
+        timings = [(stage, new["stages"][stage], old["stages"].get(stage)) for stage in STAGES]
+        timings.append(("end_to_end", new["end_to_end"], old["end_to_end"]))
+        for stage, newTiming, oldTiming in timings:
+            if oldTiming and newTiming["p50_ms"] > oldTiming["p50_ms"] * (1 + tolerance) + 0.05:
+                problems.append("%s %s p50 went from %.2f ms to %.2f ms" % (name, stage, oldTiming["p50_ms"],
+                                                                            newTiming["p50_ms"]))
+    return problems
+# end function
+
+
+###################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end speed and accuracy of the pipeline on labelled images")
+    parser.add_argument("--labels", default=LABELS_FILE)
+    parser.add_argument("--image-dir", default=IMAGE_DIR)
+    parser.add_argument("--synthetic", type=int, default=40, help="number of synthetic frames, 0 = none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over each set")
+    parser.add_argument("--backend", choices=KnnEngine.BACKENDS, default="opencv")
+    parser.add_argument("--model", default=ModelStore.MODEL_FILE, help="compiled KNN model to evaluate")
+    parser.add_argument("--classifier", default=None, help="ONNX character CNN from TrainCnn.py, default: KNN")
+    parser.add_argument("--classifier-engine", choices=CharClassifier.ENGINES, default="opencv",
+                        help="runtime for --classifier")
+    parser.add_argument("--output", "-o", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--check", default=None, help="baseline JSON report; exit 1 on an accuracy or latency regression")
+    parser.add_argument("--tolerance", type=float, default=LATENCY_TOLERANCE, help="allowed p50 slow-down for --check")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)                    # thời gian ổn định hơn, so sánh được giữa các máy nhiều core
+    recognizer = LicensePlateRecognizer(args.model, backend=args.backend, classifier=args.classifier,
+                                        classifierEngine=args.classifier_engine)
+    frames = loadLabelledFrames(loadLabels(args.labels, args.image_dir))
+    sets = {"images": frames}
+    if args.synthetic:
+        sets["synthetic"] = syntheticFrames(frames, args.synthetic, args.seed)
+
+    report = {"config": {"model": args.model, "backend": args.backend, "classifier": args.classifier,
+                         "frame_size": list(FRAME_SIZE), "synthetic": args.synthetic,
+                         "seed": args.seed, "opencv": cv2.__version__, "numpy": np.__version__},
+              "sets": {name: evaluate(setFrames, recognizer, args.repeat) for name, setFrames in sets.items()}}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for name, result in report["sets"].items():
+        accuracy = result["accuracy"]
+        print("%-10s %3d frames  %6.1f frames/sec  plates %d/%d (precision %.2f)  chars %.1f%%"
+              % (name, result["frames"], result["end_to_end"]["frames_per_sec"], accuracy["exact"],
+                 accuracy["plates"], accuracy["plate_precision"], 100 * accuracy["char_accuracy"]), file=sys.stderr)
+
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            problems = checkRegression(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print("REGRESSION: " + problem, file=sys.stderr)
+        if problems:
+            raise SystemExit(1)
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -1,9 +1,17 @@
 # GenData.py
 
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+
 import numpy as np
 import cv2
 import sys
 
+import ModelStore
+
 
 # module level variables ##########################################################################
 MIN_CONTOUR_AREA = 40
@@ -12,21 +20,41 @@ MIN_CONTOUR_AREA = 40
 RESIZED_IMAGE_WIDTH = 20
 RESIZED_IMAGE_HEIGHT = 30
 
+VALID_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+CHUNK_SIZE = 16                 # số ảnh gửi cho 1 worker mỗi lần
+SHEET_CHARACTERS = 256          # ảnh lớn chứa nhiều ký tự được chia cho nhiều worker, mỗi phần bấy nhiêu ký tự
+
+# Tăng cường dữ liệu: mỗi ký tự sinh thêm --augment bản, mỗi bản xoay / làm mờ / thêm nhiễu ngẫu nhiên
+AUGMENT_ROTATION = 6.0          # độ, xoay trong khoảng +-6
+AUGMENT_BLUR = 0.5              # xác suất làm mờ Gauss
+AUGMENT_NOISE = 0.03            # tối đa 3% điểm ảnh bị đảo trắng / đen
+
+augmentCount = 0                # tham số của tiến trình worker, đặt bởi initWorker
+augmentSeed = 0
+
 ###################################################################################################
-def main():
+def thresholdImage(imgGray):
+    imgBlurred = cv2.GaussianBlur(imgGray, (5,5), 0)                        # blur
+
+                                                        # filter image from grayscale to black and white
+    return cv2.adaptiveThreshold(imgBlurred,                                # input image
+                                 255,                                       # make pixels that pass the threshold full white
+                                 cv2.ADAPTIVE_THRESH_GAUSSIAN_C,            # use gaussian rather than mean, seems to give better results
+                                 cv2.THRESH_BINARY_INV,                     # invert so foreground will be white, background will be black
+                                 11,                                        # size of a pixel neighborhood used to calculate threshold value
+                                 2)                                         # constant subtracted from the mean or weighted mean
+# end function
+
+
+###################################################################################################
+def labelInteractively():
+    # Cách cũ: bấm phím tên ký tự cho từng contour của training_chars.png, ghi ra 2 file text
     imgTrainingNumbers = cv2.imread("training_chars.png")            # read in training numbers image
     #imgTrainingNumbers = cv2.resize(imgTrainingNumbers, dsize = None, fx = 0.5, fy = 0.5)
     
     imgGray = cv2.cvtColor(imgTrainingNumbers, cv2.COLOR_BGR2GRAY)          # get grayscale image
-    imgBlurred = cv2.GaussianBlur(imgGray, (5,5), 0)                        # blur
-
-                                                        # filter image from grayscale to black and white
-    imgThresh = cv2.adaptiveThreshold(imgBlurred,                           # input image
-                                      255,                                  # make pixels that pass the threshold full white
-                                      cv2.ADAPTIVE_THRESH_GAUSSIAN_C,       # use gaussian rather than mean, seems to give better results
-                                      cv2.THRESH_BINARY_INV,                # invert so foreground will be white, background will be black
-                                      11,                                   # size of a pixel neighborhood used to calculate threshold value
-                                      2)                                    # constant subtracted from the mean or weighted mean
+    imgThresh = thresholdImage(imgGray)
 
     cv2.imshow("imgThresh", imgThresh)      # show threshold image for reference
 
@@ -38,8 +66,8 @@ def main():
 
                                 # declare empty numpy array, we will use this to write to file later
                                 # zero rows, enough cols to hold all image data
-    npaFlattenedImages =  np.empty((0, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT))
-   
+    npaFlattenedImages = []         # các hàng được gom vào list, chỉ ghép thành mảng 1 lần ở cuối (np.append copy cả mảng mỗi lần)
+
 
     intClassifications = []         # declare empty classifications list, this will be our list of how we are classifying our chars from user input, we will write to file at the end
 
@@ -76,9 +104,7 @@ def main():
 
                 intClassifications.append(intChar)        # append classification char to integer list of chars (we will convert to float later before writing to file)
                 #Là file chứa label của tất cả các ảnh mẫu, tổng cộng có 32 x 5 = 160 mẫu.
-                npaFlattenedImage = imgROIResized.reshape((1, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT))  # flatten image to 1d numpy array so we can write to file later
-                
-                npaFlattenedImages = np.append(npaFlattenedImages, npaFlattenedImage, 0)                    # add current flattened impage numpy array to list of flattened image numpy arrays
+                npaFlattenedImages.append(imgROIResized.reshape(RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT))  # flatten image to 1d numpy array so we can write to file later
                 
             # end if
         # end if
@@ -91,12 +117,209 @@ def main():
     print ("\n\ntraining complete !!\n")
 
     np.savetxt("classifications.txt", npaClassifications)           # write flattened images to file
-    np.savetxt("flattened_images.txt", npaFlattenedImages)          #
+    np.savetxt("flattened_images.txt", np.array(npaFlattenedImages, np.float64).reshape(-1, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT))
 
     cv2.destroyAllWindows()             # remove windows from memory
 
     return
 
+###################################################################################################
+def listLabelledDir(root):
+    # Thư mục con mang tên ký tự: root/A/*.png, root/7/*.jpg ... mỗi ảnh là 1 ký tự
+    items = []
+    for label in sorted(os.listdir(root)):
+        folder = os.path.join(root, label)
+        if not os.path.isdir(folder):
+            continue
+        if label.upper() not in VALID_CHARS or len(label) != 1:
+            raise SystemExit("folder %s is not a character label (expected one of %s)" % (folder, VALID_CHARS))
+        for dirpath, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    items.append((os.path.join(dirpath, name), label.upper(), None))
+    return items
+# end function
+
+
+def readManifest(path):
+    # File CSV có cột "path,label" và tuỳ chọn "x,y,w,h" (vị trí ký tự trong 1 ảnh lớn, vd training_chars.png).
+    # Đường dẫn tương đối được tính từ thư mục chứa file manifest
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for line, row in enumerate(csv.DictReader(f), 2):
+            label = (row.get("label") or "").strip().upper()
+            if len(label) != 1 or label not in VALID_CHARS:
+                raise SystemExit("%s:%d: bad label %r" % (path, line, row.get("label")))
+            box = None
+            if row.get("x") not in (None, ""):
+                box = tuple(int(row[k]) for k in ("x", "y", "w", "h"))
+            items.append((os.path.join(base, row["path"]), label, box))
+    return items
+# end function
+
+
+###################################################################################################
+def binarize(imgGray):
+    # Ký tự trắng trên nền đen như ảnh thre_mor lúc nhận dạng. Ảnh đã nhị phân (vd cắt ra từ pipeline) giữ nguyên,
+    # ảnh xám / màu thì threshold giống training_chars.png
+    if cv2.countNonZero(cv2.inRange(imgGray, 1, 254)) == 0:
+        imgThresh = imgGray
+    else:
+        imgThresh = thresholdImage(imgGray)
+    if cv2.countNonZero(imgThresh) * 2 > imgThresh.size:
+        imgThresh = cv2.bitwise_not(imgThresh)
+    return imgThresh
+# end function
+
+
+def characterBox(imgThresh):
+    # Vùng bao của contour lớn nhất: bỏ phần nền thừa quanh ký tự giống segmentCharacters khi nhận dạng
+    contours, _ = cv2.findContours(imgThresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = [c for c in contours if cv2.contourArea(c) > MIN_CONTOUR_AREA]
+    if not contours:
+        return 0, 0, imgThresh.shape[1], imgThresh.shape[0]
+    return cv2.boundingRect(max(contours, key=cv2.contourArea))
+# end function
+
+
+def augmentCharacter(imgROI, rng):
+    (h, w) = imgROI.shape[:2]
+    pad = max(h, w) // 4                    # chừa chỗ để góc ký tự không bị cắt khi xoay
+    padded = cv2.copyMakeBorder(imgROI, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0)
+    matrix = cv2.getRotationMatrix2D((w / 2 + pad, h / 2 + pad), rng.uniform(-AUGMENT_ROTATION, AUGMENT_ROTATION), 1.0)
+    rotated = cv2.warpAffine(padded, matrix, (padded.shape[1], padded.shape[0]), flags=cv2.INTER_NEAREST)
+    (x, y, bw, bh) = cv2.boundingRect(rotated)
+    out = rotated[y:y + bh, x:x + bw] if bw and bh else imgROI
+    noise = rng.random(out.shape) < rng.uniform(0, AUGMENT_NOISE)
+    out = np.where(noise, 255 - out, out).astype(np.uint8)
+    out = cv2.resize(out, (RESIZED_IMAGE_WIDTH, RESIZED_IMAGE_HEIGHT))
+    if rng.random() < AUGMENT_BLUR:
+        out = cv2.GaussianBlur(out, (3, 3), rng.uniform(0.3, 1.0))
+    return out
+# end function
+
+
+###################################################################################################
+def initWorker(augment, seed):
+    global augmentCount, augmentSeed
+    cv2.setNumThreads(1)
+    augmentCount = augment
+    augmentSeed = seed
+# end function
+
+
+def extractCharacters(job):
+    # Chạy trong worker: 1 ảnh và các ký tự của nó [(thứ tự, nhãn, box)], trả về (thứ tự, các hàng uint8) cho từng ký tự.
+    # Ảnh lớn chỉ được đọc và threshold 1 lần cho mọi ký tự trong nó
+    path, characters = job
+    imgGray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if imgGray is None:
+        return [(index, None, "cannot read " + path) for index, _, _ in characters]
+    imgThresh = binarize(imgGray)
+    results = []
+    for index, label, box in characters:
+        (x, y, w, h) = box if box is not None else characterBox(imgThresh)
+        imgROI = imgThresh[y:y + h, x:x + w]
+        if imgROI.size == 0:
+            results.append((index, None, "empty character box in " + path))
+            continue
+        rows = np.empty((1 + augmentCount, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT), np.uint8)
+        rows[0] = cv2.resize(imgROI, (RESIZED_IMAGE_WIDTH, RESIZED_IMAGE_HEIGHT)).reshape(-1)
+        rng = np.random.default_rng((augmentSeed, index))     # kết quả không phụ thuộc số worker
+        for n in range(augmentCount):
+            rows[1 + n] = augmentCharacter(imgROI, rng).reshape(-1)
+        results.append((index, rows, None))
+    return results
+# end function
+
+
+def buildDataset(items, workers=None, augment=0, seed=0, chunkSize=CHUNK_SIZE):
+    # items: [(đường dẫn ảnh, nhãn, box hoặc None)]. Trả về samples (N, 600) uint8, labels (N, 1) float32
+    # (mã ascii như classifications.txt) và danh sách lỗi. Các hàng được ghi thẳng vào mảng cấp phát sẵn
+    # theo đúng thứ tự items, mỗi ký tự chiếm 1 + augment hàng liền nhau
+    perItem = 1 + augment
+    samples = np.empty((len(items) * perItem, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT), np.uint8)
+    labels = np.empty((len(items) * perItem, 1), np.float32)
+    valid = np.zeros(len(items) * perItem, bool)
+    errors = []
+
+    groups = {}
+    for index, (path, label, box) in enumerate(items):
+        groups.setdefault(path, []).append((index, label, box))
+        labels[index * perItem:(index + 1) * perItem] = ord(label)
+    jobs = [(path, characters[start:start + SHEET_CHARACTERS]) for path, characters in groups.items()
+            for start in range(0, len(characters), SHEET_CHARACTERS)]
+
+    if workers == 0:
+        initWorker(augment, seed)
+        batches = map(extractCharacters, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.get_context("spawn").Pool(workers or os.cpu_count() or 1, initWorker, (augment, seed))
+        batches = pool.imap_unordered(extractCharacters, jobs, chunkSize)
+    try:
+        for batch in batches:
+            for index, rows, error in batch:
+                if error is not None:
+                    errors.append(error)
+                    continue
+                samples[index * perItem:(index + 1) * perItem] = rows
+                valid[index * perItem:(index + 1) * perItem] = True
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if not valid.all():
+        samples, labels = samples[valid], labels[valid]
+    return samples, labels, errors
+# end function
+
+
+###################################################################################################
+def main():
+    # Không có tham số: gán nhãn bằng tay như cũ. Có --dir / --manifest: tạo model không cần giao diện
+    if len(sys.argv) == 1:
+        labelInteractively()
+        return
+
+    parser = argparse.ArgumentParser(description="Build the KNN character model from labelled images, no GUI")
+    parser.add_argument("--dir", action="append", default=[], help="folder with one sub-folder per character, e.g. A/")
+    parser.add_argument("--manifest", action="append", default=[], help="CSV with path,label[,x,y,w,h] columns")
+    # Không mặc định là ModelStore.MODEL_FILE: file đó được tự biên dịch lại từ các file text có sẵn
+    parser.add_argument("--output", "-o", required=True,
+                        help="compiled model to write, pass it to the other scripts with --model")
+    parser.add_argument("--augment", type=int, default=0, help="extra rotated / blurred / noisy copies per character")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="extraction processes, 0 = serial")
+    args = parser.parse_args()
+    if not args.dir and not args.manifest:
+        parser.error("give --dir or --manifest")
+
+    items = []
+    for root in args.dir:
+        items += listLabelledDir(root)
+    for path in args.manifest:
+        items += readManifest(path)
+    if not items:
+        raise SystemExit("no labelled characters found")
+
+    start = time.perf_counter()
+    samples, labels, errors = buildDataset(items, args.workers, args.augment, args.seed)
+    for error in errors:
+        print("skipped: " + error, file=sys.stderr)
+    if len(samples) == 0:
+        raise SystemExit("no character could be extracted")
+    meta = {"source": "GenData", "characters": len(items) - len(errors), "augment": args.augment, "seed": args.seed,
+            "inputs": args.dir + args.manifest}
+    ModelStore.saveModel(args.output, {"samples": samples, "labels": labels}, meta=meta)
+    elapsed = time.perf_counter() - start
+    print("%d samples (%d characters, %d skipped) written to %s in %.2f s" % (len(samples), len(items) - len(errors),
+                                                                             len(errors), args.output, elapsed))
+# end function
+
+
 ###################################################################################################
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+# Geometry.py
+
+import cv2
+import numpy as np
+
+# module level variables ##########################################################################
+APPROX_EPSILON = 0.06           # approxPolyDP: sai số = 6% chu vi
+PLATE_RATIOS = ((0.8, 1.5), (4.5, 6.5))   # biển 2 hàng / biển 1 hàng
+
+
+###################################################################################################
+def approxQuads(contours):
+    # Xấp xỉ đa giác từng contour (OpenCV chỉ làm được từng cái), trả về mảng (N, 4, 2) các contour có đúng 4 đỉnh
+    # và chỉ số của chúng trong contours
+    quads = []
+    index = []
+    for i, c in enumerate(contours):
+        approx = cv2.approxPolyDP(c, APPROX_EPSILON * cv2.arcLength(c, True), True)
+        if len(approx) == 4:
+            quads.append(approx.reshape(4, 2))
+            index.append(i)
+    if not quads:
+        return np.empty((0, 4, 2), np.int32), np.empty(0, np.intp)
+    return np.stack(quads), np.array(index, np.intp)
+# end function
+
+
+def boundingBoxes(quads):
+    # (N, 4): x, y, w, h giống cv2.boundingRect (w = max - min + 1)
+    low = quads.min(axis=1)
+    high = quads.max(axis=1)
+    return np.concatenate([low, high - low + 1], axis=1)
+# end function
+
+
+def ratioMask(boxes, ratios=PLATE_RATIOS):
+    ratio = boxes[:, 2] / boxes[:, 3]
+    mask = np.zeros(len(boxes), bool)
+    for low, high in ratios:
+        mask |= (low <= ratio) & (ratio <= high)
+    return mask
+# end function
+
+
+def filterQuads(contours, ratios=PLATE_RATIOS):
+    # Giống Detection.filterQuads cũ (vòng lặp từng contour): trả về list các contour xấp xỉ (4, 1, 2)
+    # có 4 đỉnh và tỉ lệ rộng / cao của biển số, theo thứ tự của contours.
+    # Kích thước và tỉ lệ được tính cho cả frame 1 lần bằng NumPy
+    quads, _ = approxQuads(contours)
+    keep = ratioMask(boundingBoxes(quads), ratios)
+    return [q.reshape(4, 1, 2) for q in quads[keep]]
+# end function
+
+
+###################################################################################################
+def plateAngles(quads):
+    # Góc nghiêng (độ) của mỗi biển số từ 2 đỉnh thấp nhất (y lớn nhất), giống Recognizer.plateAngle cũ:
+    # 2 đỉnh cùng y thì đỉnh đứng trước trong contour được chọn trước (sort ổn định).
+    # Dùng arctan2 nên cạnh thẳng đứng cho 90 độ thay vì chia cho 0, 2 đỉnh trùng nhau cho 0 độ thay vì nan
+    quads = np.asarray(quads).reshape(-1, 4, 2).astype(np.int64)
+    order = np.argsort(-quads[:, :, 1], axis=1, kind="stable")
+    first = np.take_along_axis(quads, order[:, 0, None, None], axis=1)[:, 0]
+    second = np.take_along_axis(quads, order[:, 1, None, None], axis=1)[:, 0]
+    doi = np.abs(first[:, 1] - second[:, 1])
+    ke = np.abs(first[:, 0] - second[:, 0])
+    angles = np.arctan2(doi, ke) * (180.0 / np.pi)
+    return np.where(first[:, 0] < second[:, 0], -angles, angles)
+# end function
@@ -0,0 +1,73 @@
+# GeometryReference.py
+# Bản cũ (từng contour một) của Detection.filterQuads và Recognizer.plateAngle trước khi có Geometry.py,
+# cùng các frame mẫu để so sánh. Dùng chung cho test_geometry.py và Benchmark.py geometry
+
+import glob
+import math
+
+import cv2
+
+from Geometry import PLATE_RATIOS
+
+# module level variables ##########################################################################
+DEFAULT_IMAGES = "data/image/*"
+FRAME_SIZE = (1920, 1080)       # Image_test2.py cũng đưa ảnh về kích thước này
+
+# Tứ giác suy biến và góc plateAngles phải trả về (None = góc hữu hạn, bằng công thức cũ)
+DEGENERATE_QUADS = (
+    ([[30, 5], [10, 10], [12, 40], [12, 60]], 90.0),        # 2 đỉnh thấp nhất cùng x (cạnh đứng)
+    ([[10, 10], [10, 10], [10, 10], [10, 10]], 0.0),        # 4 đỉnh trùng nhau
+    ([[0, 0], [50, 0], [100, 0], [150, 0]], 0.0),           # 4 đỉnh thẳng hàng
+    ([[0, 0], [100, 0], [50, 1], [0, 30]], None),           # gần như tam giác
+    ([[0, 0], [100, 0], [40, 10], [0, 30]], None),          # tứ giác lõm
+)
+
+
+###################################################################################################
+def loadFrames(pattern, size=FRAME_SIZE):
+    # size=None: giữ độ phân giải gốc như BatchRecognize.py (không --resize) / VideoPipeline.py
+    frames = []
+    for path in sorted(glob.glob(pattern)):
+        img = cv2.imread(path)
+        if img is not None:
+            frames.append((path, cv2.resize(img, dsize=size) if size is not None else img))
+    return frames
+# end function
+
+
+def tiltedFrames(frames, angles=(-12, 12)):
+    # Thêm các frame xoay nghiêng để có nhiều biển số nghiêng hơn ảnh mẫu
+    tilted = list(frames)
+    for path, img in frames:
+        (h, w) = img.shape[:2]
+        for angle in angles:
+            rotationMatrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+            tilted.append(("%s rotated %d" % (path, angle), cv2.warpAffine(img, rotationMatrix, (w, h))))
+    return tilted
+# end function
+
+
+###################################################################################################
+def filterQuadsReference(contours):
+    # Detection.filterQuads trước khi có Geometry.py (vòng lặp từng contour), giữ lại để so sánh
+    screenCnt = []
+    for c in contours:
+        peri = cv2.arcLength(c, True)  # Tính chu vi
+        approx = cv2.approxPolyDP(c, 0.06 * peri, True)  # làm xấp xỉ đa giác, chỉ giữ contour có 4 cạnh
+        [x, y, w, h] = cv2.boundingRect(approx.copy())
+        ratio = w / h
+        if (len(approx) == 4) and any(low <= ratio <= high for low, high in PLATE_RATIOS):
+            screenCnt.append(approx)
+    return screenCnt
+# end function
+
+
+def plateAngleReference(screenCnt):
+    # Recognizer.plateAngle cũ: math.atan trên số nguyên numpy, cạnh thẳng đứng chia cho 0 (cảnh báo, ra 90 độ),
+    # 2 đỉnh trùng nhau ra nan
+    array = sorted(list(screenCnt[:, 0]), reverse=True, key=lambda x: x[1])
+    (x1, y1) = array[0]
+    (x2, y2) = array[1]
+    angle = math.atan(abs(y1 - y2) / abs(x1 - x2)) * (180.0 / math.pi)
+    return -angle if x1 < x2 else angle
+# end function
@@ -0,0 +1,122 @@
+# KnnEngine.py
+
+import numpy as np
+
+import ModelStore
+
+# module level variables ##########################################################################
+BACKENDS = ("opencv", "numpy")
+STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "uint8": np.uint8}
+BLOCK_ROWS = 8192               # số mẫu train được đổi sang float64 mỗi lần, giới hạn bộ nhớ tạm
+
+
+###################################################################################################
+class NumpyKNearest:
+    # KNN brute force bằng NumPy, cùng giao diện findNearest với cv2.ml.KNearest
+    # Khoảng cách bình phương = |q|^2 - 2 q.t + |t|^2, phần q.t tính bằng 1 phép nhân ma trận (BLAS)
+    # cho cả lô truy vấn. Pixel là số nguyên 0..255 nên tính bằng float64 cho khoảng cách chính xác,
+    # thứ tự hàng xóm vì vậy trùng với OpenCV.
+    # dtype="float32": giữ sẵn ma trận train float64 đã chuyển vị, nhanh nhất.
+    # dtype="float16"/"uint8": chỉ giữ bản nén (2x / 4x nhỏ hơn), đổi sang float64 từng khối mỗi lần gọi.
+
+    def __init__(self, dtype="float32"):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError("unsupported storage dtype %r, expected one of %s" % (dtype, ", ".join(STORAGE_DTYPES)))
+        self.dtype = STORAGE_DTYPES[dtype]
+        self.samples = None
+        self.responses = None
+        self.norms = None
+        self.blocks = None
+
+    def train(self, samples, layout=None, responses=None):
+        # Giữ chữ ký train(samples, cv2.ml.ROW_SAMPLE, responses) của OpenCV
+        samples = np.asarray(samples, np.float32)
+        stored = samples.astype(self.dtype)
+        if not np.array_equal(stored.astype(np.float32), samples):
+            raise ValueError("training samples cannot be stored losslessly as " + np.dtype(self.dtype).name)
+        self.samples = stored
+        self.responses = np.asarray(responses, np.float32).reshape(-1)
+        self.norms = np.einsum("ij,ij->i", samples.astype(np.float64), samples.astype(np.float64))
+        self.blocks = None
+        if self.dtype == np.float32:
+            self.blocks = [self.computeBlock(start) for start in range(0, len(stored), BLOCK_ROWS)]
+        return True
+
+    def computeBlock(self, start):
+        return np.ascontiguousarray(self.samples[start:start + BLOCK_ROWS].astype(np.float64).T)
+
+    def getDefaultK(self):
+        return 10
+
+    def isTrained(self):
+        return self.samples is not None
+
+    def distances(self, queries):
+        queries = np.asarray(queries, np.float64)
+        queryNorms = np.einsum("ij,ij->i", queries, queries)
+        dists = np.empty((len(queries), len(self.samples)), np.float64)
+        for i, start in enumerate(range(0, len(self.samples), BLOCK_ROWS)):
+            block = self.blocks[i] if self.blocks is not None else self.computeBlock(start)
+            np.matmul(queries, block, out=dists[:, start:start + block.shape[1]])
+        dists *= -2.0
+        dists += queryNorms[:, None]
+        dists += self.norms[None, :]
+        return dists
+
+    def findNearest(self, samples, k):
+        samples = np.asarray(samples, np.float32).reshape(-1, self.samples.shape[1])
+        k = min(k, len(self.samples))
+        dists = self.distances(samples)
+
+        # k mẫu gần nhất; cùng khoảng cách thì mẫu đứng trước trong tập train thắng, giống OpenCV
+        if k < len(self.samples):
+            nearest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(len(self.samples)), dists.shape).copy()
+        nearestDists = np.take_along_axis(dists, nearest, axis=1)
+        order = np.lexsort((nearest, nearestDists), axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearestDists = np.take_along_axis(nearestDists, order, axis=1)
+        neighborResponses = self.responses[nearest]
+
+        results = vote(neighborResponses).reshape(-1, 1)
+        return float(results[0, 0]), results, neighborResponses, nearestDists.astype(np.float32)
+# end class
+
+
+class ProjectedKNearest:
+    # Model đã nén bằng ModelCompact.py --pca: chiếu ký tự 600 điểm ảnh xuống không gian của model
+    # ((x - mean) @ basis.T) rồi mới tìm hàng xóm
+    def __init__(self, kNearest, mean, basis):
+        self.kNearest = kNearest
+        self.mean = np.asarray(mean, np.float32)
+        self.basis = np.asarray(basis, np.float32)
+
+    def findNearest(self, samples, k):
+        samples = np.asarray(samples, np.float32).reshape(-1, self.basis.shape[1])
+        return self.kNearest.findNearest(np.ascontiguousarray((samples - self.mean) @ self.basis.T), k)
+# end class
+
+
+###################################################################################################
+def vote(neighborResponses):
+    # Nhãn xuất hiện nhiều nhất trong k hàng xóm; hòa thì lấy nhãn nhỏ nhất (cách OpenCV bỏ phiếu)
+    ordered = np.sort(neighborResponses, axis=1)
+    counts = (ordered[:, :, None] == ordered[:, None, :]).sum(axis=2)
+    best = np.argmax(counts, axis=1)
+    return ordered[np.arange(len(ordered)), best]
+# end function
+
+
+def createKNearest(model, backend="opencv", dtype="float32"):
+    if backend == "opencv":
+        kNearest = ModelStore.createKNearest(model)
+    elif backend == "numpy":
+        kNearest = NumpyKNearest(dtype)
+        kNearest.train(model.samples, None, model.labels)
+    else:
+        raise ValueError("unknown KNN backend %r, expected one of %s" % (backend, ", ".join(BACKENDS)))
+    if "projection" in model.extras:
+        kNearest = ProjectedKNearest(kNearest, model.extras["projection_mean"], model.extras["projection"])
+    return kNearest
+# end function
@@ -0,0 +1,117 @@
+# Metrics.py
+
+import bisect
+from collections import defaultdict
+
+# module level variables ##########################################################################
+STAGES = ("preprocess", "contours", "quad_filter", "detect", "cascade", "cache", "deskew", "segmentation", "knn")
+COUNTERS = ("contours", "quads", "rejected_size", "rejected_foreground", "rejected_chars", "plates", "chars")
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)   # giây
+PREFIX = "lpr_"
+
+
+###################################################################################################
+class FrameRecord:
+    # Số liệu của 1 frame, được gửi cho callback: thời gian từng bước (giây) và số lượng ứng viên
+    __slots__ = ("stages", "counts")
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(int)
+# end class
+
+
+class PipelineMetrics:
+    # Bộ đếm cho LicensePlateRecognizer(metrics=...). Khi không truyền metrics, recognize() không đo gì cả.
+    # callback(record): gọi sau mỗi frame với FrameRecord của frame đó (vd để ghi log frame chậm)
+    # Mỗi tiến trình giữ 1 đối tượng riêng, gộp lại bằng merge()
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.frames = 0
+        self.stageSeconds = defaultdict(float)
+        self.stageCalls = defaultdict(int)
+        self.stageBuckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.counters = defaultdict(int)
+        self.cacheHits = defaultdict(int)
+        self.cacheMisses = defaultdict(int)
+
+    def __getstate__(self):
+        # gửi được qua multiprocessing.Queue (callback và lambda không pickle được)
+        state = self.__dict__.copy()
+        state["callback"] = None
+        state["stageBuckets"] = dict(self.stageBuckets)
+        return state
+
+    def __setstate__(self, state):
+        buckets = state.pop("stageBuckets")
+        self.__dict__.update(state)
+        self.stageBuckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1), buckets)
+
+    def recordFrame(self, record):
+        self.frames = self.frames + 1
+        for stage, seconds in record.stages.items():
+            self.stageSeconds[stage] += seconds
+            self.stageCalls[stage] += 1
+            self.stageBuckets[stage][bisect.bisect_left(BUCKETS, seconds)] += 1
+        for name, value in record.counts.items():
+            self.counters[name] += value
+        if self.callback is not None:
+            self.callback(record)
+
+    def cacheHit(self, cache, hits=1):
+        self.cacheHits[cache] += hits
+
+    def cacheMiss(self, cache, misses=1):
+        self.cacheMisses[cache] += misses
+
+    def hitRate(self, cache):
+        total = self.cacheHits[cache] + self.cacheMisses[cache]
+        return self.cacheHits[cache] / float(total) if total else 0.0
+
+    def merge(self, other):
+        self.frames += other.frames
+        for stage in other.stageCalls:
+            self.stageSeconds[stage] += other.stageSeconds[stage]
+            self.stageCalls[stage] += other.stageCalls[stage]
+            self.stageBuckets[stage] = [a + b for a, b in zip(self.stageBuckets[stage], other.stageBuckets[stage])]
+        for target, source in ((self.counters, other.counters), (self.cacheHits, other.cacheHits),
+                               (self.cacheMisses, other.cacheMisses)):
+            for name, value in source.items():
+                target[name] += value
+        return self
+
+    def prometheusText(self):
+        # Định dạng text của Prometheus (exposition format 0.0.4)
+        lines = ["# HELP %sframes_total Frames run through the recognizer." % PREFIX,
+                 "# TYPE %sframes_total counter" % PREFIX,
+                 "%sframes_total %d" % (PREFIX, self.frames),
+                 "# HELP %sstage_seconds Time spent in each pipeline stage per frame." % PREFIX,
+                 "# TYPE %sstage_seconds histogram" % PREFIX]
+        for stage in [s for s in STAGES if s in self.stageCalls] + sorted(set(self.stageCalls) - set(STAGES)):
+            cumulative = 0
+            for le, count in zip(BUCKETS + ("+Inf",), self.stageBuckets[stage]):
+                cumulative += count
+                lines.append('%sstage_seconds_bucket{stage="%s",le="%s"} %d' % (PREFIX, stage, le, cumulative))
+            lines.append('%sstage_seconds_sum{stage="%s"} %.6f' % (PREFIX, stage, self.stageSeconds[stage]))
+            lines.append('%sstage_seconds_count{stage="%s"} %d' % (PREFIX, stage, self.stageCalls[stage]))
+        helps = {"contours": "Contours kept for the quad filter.", "quads": "4-corner plate-shaped candidates.",
+                 "rejected_size": "Candidates rejected early by bounding box area.",
+                 "rejected_foreground": "Candidates rejected early by foreground density.",
+                 "rejected_chars": "Candidates rejected early by the unrotated character count.",
+                 "plates": "Candidates passing the character count check, plate cache hits included.",
+                 "chars": "Characters classified by KNN."}
+        for name in list(COUNTERS) + sorted(set(self.counters) - set(COUNTERS)):
+            lines.append("# HELP %s%s_total %s" % (PREFIX, name, helps.get(name, name)))
+            lines.append("# TYPE %s%s_total counter" % (PREFIX, name))
+            lines.append("%s%s_total %d" % (PREFIX, name, self.counters[name]))
+        for name, source, text in (("cache_hits_total", self.cacheHits, "Lookups answered from a cache."),
+                                   ("cache_misses_total", self.cacheMisses, "Lookups not found in a cache.")):
+            if not source:
+                continue
+            lines.append("# HELP %s%s %s" % (PREFIX, name, text))
+            lines.append("# TYPE %s%s counter" % (PREFIX, name))
+            for cache in sorted(source):
+                lines.append('%s%s{cache="%s"} %d' % (PREFIX, name, cache, source[cache]))
+        return "\n".join(lines) + "\n"
+# end class
@@ -0,0 +1,230 @@
+# ModelCompact.py
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import KnnEngine
+import ModelStore
+
+# module level variables ##########################################################################
+HOLDOUT = 0.2                   # tỉ lệ ký tự giữ lại để đo độ chính xác, không dùng để nén
+TOLERANCE = 0.01                # độ chính xác trên tập giữ lại được phép giảm tối đa 1 điểm phần trăm
+KNN_K = 3                       # giống Recognizer.KNN_K
+BLOCK_ROWS = 1024               # số mẫu tính khoảng cách cùng lúc khi condense
+REPORT_PCA = (20, 40, 60)
+REPORT_CENTROIDS = (5, 10)
+
+
+###################################################################################################
+def groupIds(model):
+    # Model của GenData.py --augment N: mỗi ký tự gốc và N bản tăng cường nằm liền nhau, phải ở cùng 1 phía
+    # khi chia tập giữ lại, nếu không độ chính xác đo được sẽ cao hơn thực tế
+    perItem = 1 + int(model.meta.get("augment", 0))
+    return np.arange(len(model.labels)) // perItem
+# end function
+
+
+def splitHoldout(model, fraction=HOLDOUT, seed=0):
+    # Chia theo từng nhãn để nhãn nào cũng có mẫu ở tập giữ lại (nếu có từ 2 ký tự gốc trở lên)
+    rng = np.random.default_rng(seed)
+    labels = model.labels.reshape(-1)
+    groups = groupIds(model)
+    test = np.zeros(len(labels), bool)
+    for label in np.unique(labels):
+        ids = np.unique(groups[labels == label])
+        if len(ids) < 2:
+            continue
+        chosen = rng.choice(ids, max(1, int(round(len(ids) * fraction))), replace=False)
+        test |= np.isin(groups, chosen)
+    samples = np.asarray(model.samples, np.float32)
+    return (samples[~test], model.labels[~test]), (samples[test], model.labels[test])
+# end function
+
+
+###################################################################################################
+def pcaProjection(samples, dims):
+    # Trả về (mean, basis): ký tự x được chiếu thành (x - mean) @ basis.T, và tỉ lệ phương sai giữ lại
+    mean = samples.mean(axis=0, keepdims=True)
+    _, singular, vt = np.linalg.svd(samples - mean, full_matrices=False)
+    variance = singular ** 2
+    return mean.astype(np.float32), vt[:dims].astype(np.float32), float(variance[:dims].sum() / variance.sum())
+# end function
+
+
+def condense(samples, labels, seed=0):
+    # Condensed nearest neighbour (Hart): chỉ giữ các mẫu mà tập đã giữ phân loại sai (bỏ phiếu KNN_K hàng xóm
+    # như lúc nhận dạng), lặp tới khi không đổi.
+    # Mỗi vòng phân loại theo khối BLOCK_ROWS mẫu rồi thêm mẫu sai đầu tiên của khối, nhanh hơn thêm từng mẫu một
+    rng = np.random.default_rng(seed)
+    labels = labels.reshape(-1)
+    order = rng.permutation(len(labels))
+    _, first = np.unique(labels[order], return_index=True)
+    keep = np.zeros(len(labels), bool)
+    keep[order[first]] = True                       # mỗi nhãn bắt đầu với 1 mẫu
+    norms = np.einsum("ij,ij->i", samples, samples)
+    changed = True
+    while changed:
+        changed = False
+        for start in range(0, len(order), BLOCK_ROWS):
+            block = order[start:start + BLOCK_ROWS]
+            block = block[~keep[block]]
+            while len(block):
+                kept = np.flatnonzero(keep)
+                dists = norms[block, None] - 2.0 * samples[block] @ samples[kept].T + norms[None, kept]
+                k = min(KNN_K, len(kept))
+                nearest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+                wrong = np.flatnonzero(KnnEngine.vote(labels[kept[nearest]]) != labels[block])
+                if not len(wrong):
+                    break
+                keep[block[wrong[0]]] = True
+                changed = True
+                block = block[wrong[0] + 1:]
+                block = block[~keep[block]]
+    return np.flatnonzero(keep)
+# end function
+
+
+def centroids(samples, labels, perClass, seed=0):
+    # perClass tâm cụm (k-means) cho mỗi nhãn thay cho toàn bộ mẫu của nhãn đó
+    rng = np.random.default_rng(seed)
+    labels = labels.reshape(-1)
+    rows = []
+    rowLabels = []
+    for label in np.unique(labels):
+        group = samples[labels == label].astype(np.float64)
+        k = min(perClass, len(group))
+        centers = group[rng.choice(len(group), k, replace=False)].astype(np.float64)
+        for _ in range(20):
+            dists = -2.0 * group @ centers.T + np.einsum("ij,ij->i", centers, centers)[None, :]
+            assign = np.argmin(dists, axis=1)
+            moved = np.array([group[assign == c].mean(axis=0) if np.any(assign == c) else centers[c]
+                              for c in range(k)])
+            if np.allclose(moved, centers):
+                break
+            centers = moved
+        rows.append(centers)
+        rowLabels += [label] * k
+    return np.concatenate(rows).astype(np.float32), np.array(rowLabels, np.float32).reshape(-1, 1)
+# end function
+
+
+###################################################################################################
+def compact(samples, labels, pca=None, condensed=False, perClass=None, seed=0):
+    # Áp dụng lần lượt: chiếu PCA, rồi giảm số mẫu (condense hoặc centroids).
+    # Trả về các mảng để ghi vào ModelStore và danh sách các bước đã làm (lưu trong meta["reduction"])
+    arrays = {}
+    steps = []
+    if pca:
+        mean, basis, kept = pcaProjection(samples, pca)
+        samples = (samples - mean) @ basis.T
+        arrays["projection_mean"] = mean
+        arrays["projection"] = basis
+        steps.append({"method": "pca", "dims": int(basis.shape[0]), "explained_variance": round(kept, 4)})
+    if condensed:
+        rowsBefore = len(samples)
+        keep = condense(samples, labels, seed)
+        samples, labels = samples[keep], labels[keep]
+        steps.append({"method": "condense", "rows_before": rowsBefore, "rows_after": len(samples)})
+    elif perClass:
+        rowsBefore = len(samples)
+        samples, labels = centroids(samples, labels, perClass, seed)
+        steps.append({"method": "centroids", "per_class": perClass, "rows_before": rowsBefore,
+                      "rows_after": len(samples)})
+    samples = np.ascontiguousarray(samples, np.float32)
+    if not pca and not perClass:
+        samples = samples.astype(np.uint8)          # vẫn là các điểm ảnh gốc 0..255, lưu gọn như GenData.py
+    arrays["samples"] = samples
+    arrays["labels"] = np.ascontiguousarray(labels, np.float32)
+    return arrays, steps
+# end function
+
+
+def measure(arrays, testSamples, testLabels, backend="numpy", repeat=5):
+    # Độ chính xác (k=KNN_K) trên tập giữ lại, thời gian tìm hàng xóm mỗi ký tự và dung lượng model
+    extras = {name: a for name, a in arrays.items() if name not in ("samples", "labels")}
+    kNearest = KnnEngine.createKNearest(ModelStore.KnnModel(arrays["samples"], arrays["labels"], extras=extras), backend)
+    _, results, _, _ = kNearest.findNearest(testSamples, k=KNN_K)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kNearest.findNearest(testSamples, k=KNN_K)
+        best = min(best, time.perf_counter() - start)
+    return {"rows": int(arrays["samples"].shape[0]), "dims": int(arrays["samples"].shape[1]),
+            "bytes": int(sum(a.nbytes for a in arrays.values())),
+            "accuracy": float(np.mean(results.reshape(-1) == testLabels.reshape(-1))),
+            "us_per_char": 1e6 * best / max(1, len(testSamples))}
+# end function
+
+
+###################################################################################################
+def report(model, seed=0, backend="numpy"):
+    (trainSamples, trainLabels), (testSamples, testLabels) = splitHoldout(model, seed=seed)
+    variants = [("full", {})]
+    variants += [("pca %d" % d, {"pca": d}) for d in REPORT_PCA]
+    variants.append(("condense", {"condensed": True}))
+    variants += [("centroids %d" % n, {"perClass": n}) for n in REPORT_CENTROIDS]
+    variants.append(("pca %d + condense" % REPORT_PCA[1], {"pca": REPORT_PCA[1], "condensed": True}))
+    print("%d training / %d held-out samples, %s backend, k=%d" % (len(trainLabels), len(testLabels), backend, KNN_K))
+    print("%-20s %7s %5s %10s %10s %9s" % ("model", "rows", "dims", "KB", "us/char", "accuracy"))
+    for name, options in variants:
+        arrays, _ = compact(trainSamples, trainLabels, seed=seed, **options)
+        result = measure(arrays, testSamples, testLabels, backend)
+        print("%-20s %7d %5d %10.1f %10.2f %8.2f%%" % (name, result["rows"], result["dims"], result["bytes"] / 1024,
+                                                       result["us_per_char"], 100 * result["accuracy"]))
+# end function
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink the KNN model: PCA projection and/or fewer training rows")
+    parser.add_argument("model", nargs="?", default=ModelStore.MODEL_FILE, help="compiled KNN model to compact")
+    parser.add_argument("--output", "-o", default=None, help="write the compacted model here")
+    parser.add_argument("--pca", type=int, default=None, help="project the 600 pixels onto this many components")
+    parser.add_argument("--condense", action="store_true", help="keep only the rows condensed nearest neighbour needs")
+    parser.add_argument("--centroids", type=int, default=None, help="replace each class by this many k-means centres")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="largest held-out accuracy drop allowed before refusing to write")
+    parser.add_argument("--backend", choices=KnnEngine.BACKENDS, default="numpy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", action="store_true", help="print the size/latency/accuracy of several reductions")
+    args = parser.parse_args()
+    if args.condense and args.centroids:
+        parser.error("--condense and --centroids both reduce rows, pick one")
+
+    model = ModelStore.loadModel(args.model)
+    if model.meta.get("reduction"):
+        # pca, condense hay centroids đều vậy: nén lại hoặc đo trên dữ liệu đã bị lược bớt cho độ chính xác sai lệch
+        raise SystemExit("%s is already compacted (%s)" % (args.model, model.meta["reduction"]))
+    if args.report:
+        report(model, args.seed, args.backend)
+    if args.output is None:
+        return
+    if not (args.pca or args.condense or args.centroids):
+        parser.error("give --pca, --condense and/or --centroids")
+
+    # Đo trên tập giữ lại, chỉ ghi model (nén trên toàn bộ dữ liệu) khi độ chính xác giảm không quá tolerance
+    options = {"pca": args.pca, "condensed": args.condense, "perClass": args.centroids, "seed": args.seed}
+    (trainSamples, trainLabels), (testSamples, testLabels) = splitHoldout(model, seed=args.seed)
+    full = measure(compact(trainSamples, trainLabels)[0], testSamples, testLabels, args.backend)
+    reduced = measure(compact(trainSamples, trainLabels, **options)[0], testSamples, testLabels, args.backend)
+    print("held-out accuracy %.2f%% -> %.2f%%, %d -> %d rows, %d -> %d dims, %.2f -> %.2f us/char"
+          % (100 * full["accuracy"], 100 * reduced["accuracy"], full["rows"], reduced["rows"], full["dims"],
+             reduced["dims"], full["us_per_char"], reduced["us_per_char"]))
+    if full["accuracy"] - reduced["accuracy"] > args.tolerance:
+        raise SystemExit("accuracy drops by more than %.2f%%, model not written" % (100 * args.tolerance))
+
+    arrays, steps = compact(np.asarray(model.samples, np.float32), model.labels, **options)
+    meta = dict(model.meta, reduction=steps, compacted_from=args.model,
+                holdout={"fraction": HOLDOUT, "accuracy_before": round(full["accuracy"], 4),
+                         "accuracy_after": round(reduced["accuracy"], 4)})
+    ModelStore.saveModel(args.output, arrays, meta=meta)
+    print("%d rows x %d dims written to %s" % (arrays["samples"].shape[0], arrays["samples"].shape[1], args.output),
+          file=sys.stderr)
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,244 @@
+# ModelStore.py
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+import cv2
+import numpy as np
+
+# module level variables ##########################################################################
+CLASSIFICATIONS_FILE = "classifications.txt"     # đầu ra dạng text của GenData.py
+FLATTENED_IMAGES_FILE = "flattened_images.txt"
+MODEL_FILE = "knn_model.bin"                     # bản biên dịch nhị phân của 2 file trên
+
+MODEL_MAGIC = b"LPKNN\x00\x00\x00"
+MODEL_VERSION = 1
+PREFIX = struct.Struct("<8sII")                  # magic, version, độ dài header json
+ALIGNMENT = 64                                   # mỗi mảng bắt đầu ở offset chia hết cho 64 byte
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+###################################################################################################
+class KnnModel:
+    # samples: (N, 600) ảnh ký tự đã làm phẳng, labels: (N, 1) mã ascii dạng float32
+    # extras: các mảng phụ khác được lưu kèm, meta: thông tin mô tả model
+    # sources: kích thước/thời gian sửa/sha1 của các file text đã dùng để biên dịch
+    def __init__(self, samples, labels, meta=None, extras=None, path=None, sources=None):
+        self.samples = samples
+        self.labels = labels
+        self.meta = meta if meta is not None else {}
+        self.extras = extras if extras is not None else {}
+        self.path = path
+        self.sources = sources if sources is not None else {}
+
+    def __len__(self):
+        return len(self.labels)
+# end class
+
+
+###################################################################################################
+def sourceInfo(path, withHash=True):
+    st = os.stat(path)
+    info = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if withHash:
+        info["sha1"] = fileHash(path)
+    return info
+# end function
+
+
+def fileHash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+# end function
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+# end function
+
+
+###################################################################################################
+def saveModel(path, arrays, meta=None, sources=None):
+    # Ghi các mảng numpy vào 1 file nhị phân: prefix + header json + dữ liệu thô đã căn lề
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+
+    entries = {}
+    offset = 0
+    for name, a in arrays.items():
+        entries[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset, "nbytes": a.nbytes,
+                         "crc32": zlib.crc32(a.data.cast("B"))}
+        offset = _align(offset + a.nbytes)
+
+    header = {"version": MODEL_VERSION, "arrays": entries,
+              "sources": sources or {}, "meta": meta or {}}
+    headerBytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    dataStart = _align(PREFIX.size + len(headerBytes))
+    headerBytes = headerBytes.ljust(dataStart - PREFIX.size, b" ")
+
+    # Ghi ra file tạm rồi đổi tên, tránh để lại file hỏng. Mỗi tiến trình 1 file tạm riêng (cùng thư mục để
+    # os.replace là thao tác nguyên tử): nhiều worker cùng biên dịch lại model không ghi đè file tạm của nhau
+    (directory, base) = os.path.split(os.path.abspath(path))
+    fd, tmpPath = tempfile.mkstemp(prefix=base + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREFIX.pack(MODEL_MAGIC, MODEL_VERSION, len(headerBytes)))
+            f.write(headerBytes)
+            for name, a in arrays.items():
+                f.seek(dataStart + entries[name]["offset"])
+                f.write(a.data.cast("B"))
+            f.truncate(dataStart + offset)
+        os.chmod(tmpPath, 0o644)       # mkstemp tạo file chỉ chủ sở hữu đọc được
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
+# end function
+
+
+###################################################################################################
+def readHeader(path):
+    with open(path, "rb") as f:
+        prefix = f.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise ModelStoreError("truncated model file: " + path)
+        magic, version, headerLen = PREFIX.unpack(prefix)
+        if magic != MODEL_MAGIC:
+            raise ModelStoreError("not a compiled KNN model: " + path)
+        if version != MODEL_VERSION:
+            raise ModelStoreError("unsupported model version %d in %s" % (version, path))
+        header = json.loads(f.read(headerLen).decode("utf-8"))
+    header["data_start"] = PREFIX.size + headerLen
+    return header
+# end function
+
+
+def readModel(path, verify=True):
+    # Map file vào bộ nhớ, các mảng trả về là view chỉ đọc trên vùng map (không copy)
+    header = readHeader(path)
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        start = header["data_start"] + entry["offset"]
+        if start + entry["nbytes"] > len(buf):
+            raise ModelStoreError("truncated model file: " + path)
+        if verify and zlib.crc32(memoryview(buf)[start:start + entry["nbytes"]]) != entry["crc32"]:
+            raise ModelStoreError("checksum mismatch for '%s' in %s" % (name, path))
+        dtype = np.dtype(entry["dtype"])
+        count = entry["nbytes"] // dtype.itemsize
+        arrays[name] = np.frombuffer(buf, dtype, count, start).reshape(entry["shape"])
+
+    samples = arrays.pop("samples")
+    labels = arrays.pop("labels")
+    return KnnModel(samples, labels, header["meta"], arrays, path, header["sources"])
+# end function
+
+
+###################################################################################################
+def compileModel(classificationsPath=CLASSIFICATIONS_FILE, flattenedPath=FLATTENED_IMAGES_FILE,
+                 modelPath=MODEL_FILE):
+    # Đọc 2 file text của GenData.py (chậm) đúng 1 lần rồi ghi ra dạng nhị phân
+    npaClassifications = np.loadtxt(classificationsPath, np.float32)
+    npaFlattenedImages = np.loadtxt(flattenedPath, np.float32)
+    npaClassifications = npaClassifications.reshape((npaClassifications.size, 1))
+    if len(npaClassifications) != len(npaFlattenedImages):
+        raise ModelStoreError("%s and %s have different sample counts" % (classificationsPath, flattenedPath))
+
+    sources = {"classifications": sourceInfo(classificationsPath),
+               "flattened_images": sourceInfo(flattenedPath)}
+    saveModel(modelPath, {"samples": npaFlattenedImages, "labels": npaClassifications},
+              meta={"source": "GenData"}, sources=sources)
+    return readModel(modelPath)
+# end function
+
+
+def isStale(model, sourcePaths):
+    # So sánh kích thước + thời gian sửa của file nguồn, chỉ tính sha1 khi 2 giá trị đó thay đổi
+    for key, path in sourcePaths.items():
+        recorded = model.sources.get(key)
+        if recorded is None or not os.path.exists(path):
+            continue
+        current = sourceInfo(path, withHash=False)
+        if current["size"] == recorded["size"] and current["mtime_ns"] == recorded["mtime_ns"]:
+            continue
+        if current["size"] != recorded["size"] or fileHash(path) != recorded["sha1"]:
+            return True
+    return False
+# end function
+
+
+def rebuildModel(classificationsPath, flattenedPath, modelPath):
+    # Nhiều tiến trình có thể cùng biên dịch lại: nếu không đổi tên được file tạm (vd Windows khi tiến trình khác
+    # đang map file) thì đọc lại file mà tiến trình kia đã ghi
+    try:
+        return compileModel(classificationsPath, flattenedPath, modelPath)
+    except OSError:
+        try:
+            return readModel(modelPath)
+        except (OSError, ValueError, ModelStoreError):
+            pass
+        raise
+# end function
+
+
+def builtFromSources(modelPath):
+    # Model do compileModel ghi ra có ghi lại file text nguồn; model của GenData.py --dir / --manifest,
+    # ModelCompact.py... thì không, không được biên dịch lại đè lên. Không đọc được header thì không biết, coi như có
+    try:
+        return bool(readHeader(modelPath).get("sources"))
+    except (OSError, ValueError, ModelStoreError):
+        return True
+# end function
+
+
+def loadModel(modelPath=MODEL_FILE, classificationsPath=CLASSIFICATIONS_FILE,
+              flattenedPath=FLATTENED_IMAGES_FILE, verify=True):
+    # Nạp model đã biên dịch. Chỉ model mặc định (MODEL_FILE) được tự biên dịch lại từ các file text khi chưa có,
+    # bị hỏng hoặc file text nguồn đã đổi; đường dẫn khác (--model của các script) sai hay hỏng thì báo lỗi,
+    # không lặng lẽ thay bằng model mặc định. Model không biên dịch từ các file text (builtFromSources) cũng không
+    # bao giờ bị ghi đè, kể cả khi nằm ở MODEL_FILE
+    sourcePaths = {"classifications": classificationsPath, "flattened_images": flattenedPath}
+    canRebuild = (os.path.abspath(modelPath) == os.path.abspath(MODEL_FILE)
+                  and all(os.path.exists(p) for p in sourcePaths.values()))
+
+    try:
+        model = readModel(modelPath, verify)
+    except (OSError, ValueError, ModelStoreError):
+        if not canRebuild or not builtFromSources(modelPath):
+            raise
+        return rebuildModel(classificationsPath, flattenedPath, modelPath)
+
+    if canRebuild and isStale(model, sourcePaths):
+        return rebuildModel(classificationsPath, flattenedPath, modelPath)
+    return model
+# end function
+
+
+def createKNearest(model):
+    kNearest = cv2.ml.KNearest_create()  # instantiate KNN object
+    kNearest.train(np.ascontiguousarray(model.samples, np.float32), cv2.ml.ROW_SAMPLE,
+                   np.ascontiguousarray(model.labels, np.float32))
+    return kNearest
+# end function
+
+
+###################################################################################################
+if __name__ == "__main__":
+    modelPath = sys.argv[1] if len(sys.argv) > 1 else MODEL_FILE
+    model = compileModel(modelPath=modelPath)
+    print("compiled %d samples x %d features into %s" % (model.samples.shape[0], model.samples.shape[1], modelPath))
+# end if
@@ -0,0 +1,112 @@
+# MotionGate.py
+
+import cv2
+
+# module level variables ##########################################################################
+POLICIES = ("always", "motion", "adaptive")
+METHODS = ("diff", "background")
+
+GATE_SCALE = 0.125              # so sánh trên ảnh thu nhỏ 8 lần: 1920x1080 -> 240x135
+DIFF_THRESHOLD = 25             # chênh lệch cường độ sáng để coi 1 điểm ảnh là thay đổi
+MIN_MOTION = 0.002              # tỉ lệ điểm ảnh thay đổi tối thiểu để coi là có chuyển động
+HOLD_FRAMES = 15                # tiếp tục xử lý mọi frame thêm bấy nhiêu frame sau lần chuyển động cuối
+IDLE_EVERY = 10                 # policy "adaptive": khi đứng yên chỉ xử lý 1 trong 10 frame
+
+
+###################################################################################################
+class MotionGate:
+    # Cổng rẻ tiền đặt trước pipeline nhận dạng: quyết định frame nào cần xử lý.
+    #   "always":   xử lý mọi frame (như cũ)
+    #   "motion":   chỉ xử lý khi có chuyển động trong vùng quan tâm (và HOLD_FRAMES frame sau đó)
+    #   "adaptive": như "motion" nhưng khi đứng yên vẫn xử lý 1 trong IDLE_EVERY frame
+    # method "diff" so sánh với frame trước, "background" dùng bộ trừ nền MOG2.
+    # roi = (x, y, w, h) trên frame gốc, None = cả frame
+
+    def __init__(self, policy="adaptive", method="diff", roi=None, scale=GATE_SCALE, threshold=DIFF_THRESHOLD,
+                 minMotion=MIN_MOTION, holdFrames=HOLD_FRAMES, idleEvery=IDLE_EVERY):
+        if policy not in POLICIES:
+            raise ValueError("unknown gate policy %r, expected one of %s" % (policy, ", ".join(POLICIES)))
+        if method not in METHODS:
+            raise ValueError("unknown motion method %r, expected one of %s" % (method, ", ".join(METHODS)))
+        self.policy = policy
+        self.method = method
+        self.roi = roi
+        self.scale = scale
+        self.threshold = threshold
+        self.minMotion = minMotion
+        self.holdFrames = holdFrames
+        self.idleEvery = idleEvery
+
+        self.previous = None
+        self.subtractor = None
+        if method == "background":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=200, varThreshold=threshold,
+                                                                 detectShadows=False)
+        self.sinceMotion = holdFrames + 1
+        self.sinceProcessed = 0
+        self.frames = 0
+        self.processed = 0
+        self.motionFrames = 0
+
+    def smallGray(self, frame):
+        if self.roi is not None:
+            (x, y, w, h) = self.roi
+            frame = frame[y:y + h, x:x + w]
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def motionRatio(self, frame):
+        small = self.smallGray(frame)
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(small)
+        else:
+            if self.previous is None or self.previous.shape != small.shape:
+                self.previous = small
+                return 1.0                      # frame đầu tiên luôn được xử lý
+            diff = cv2.absdiff(small, self.previous)
+            self.previous = small
+            _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(mask) / float(mask.size)
+
+    def shouldProcess(self, frame):
+        self.frames = self.frames + 1
+        if self.policy == "always":
+            process = True
+        else:
+            if self.motionRatio(frame) >= self.minMotion:
+                self.motionFrames = self.motionFrames + 1
+                self.sinceMotion = 0
+            else:
+                self.sinceMotion = self.sinceMotion + 1
+
+            process = self.sinceMotion <= self.holdFrames
+            if not process and self.policy == "adaptive":
+                process = self.sinceProcessed + 1 >= self.idleEvery
+
+        if process:
+            self.processed = self.processed + 1
+            self.sinceProcessed = 0
+        else:
+            self.sinceProcessed = self.sinceProcessed + 1
+        return process
+
+    @property
+    def skipped(self):
+        return self.frames - self.processed
+
+    def stats(self):
+        return {"policy": self.policy, "method": self.method, "frames": self.frames, "processed": self.processed,
+                "skipped": self.skipped, "motion_frames": self.motionFrames,
+                "skip_rate": self.skipped / float(self.frames) if self.frames else 0.0}
+
+    def summary(self):
+        return formatStats(self.stats())
+# end class
+
+
+def formatStats(stats):
+    return ("gate %(policy)s/%(method)s: %(processed)d of %(frames)d frames processed, %(skipped)d skipped "
+            "(%(motion_frames)d with motion)" % stats)
+# end function
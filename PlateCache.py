@@ -0,0 +1,105 @@
+# PlateCache.py
+
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# module level variables ##########################################################################
+HASH_SIZE = (32, 16)            # ảnh nhị phân của biển số được thu về 32x16 điểm = mã hash 512 bit
+MAX_ENTRIES = 256
+TTL = 60.0                      # giây; hết hạn thì OCR lại dù biển số không đổi
+# Số bit khác nhau tối đa để coi 2 biển số là 1. Đo trên video thử: cùng 1 biển số ở 2 frame liên tiếp
+# lệch 0 - 18 bit, 2 biển số khác nhau trong data/image lệch ít nhất 45 bit (cùng chữ) / 95 bit (khác chữ)
+TOLERANCE = 24
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+###################################################################################################
+def plateHash(imgThreshplate, screenCnt, size=HASH_SIZE):
+    # Perceptual hash của vùng bao biển số trên ảnh nhị phân: thu nhỏ về kích thước cố định (không phụ thuộc
+    # khoảng cách tới camera), điểm nào trắng quá nửa thì là bit 1
+    (x, y, w, h) = cv2.boundingRect(screenCnt)
+    small = cv2.resize(imgThreshplate[y:y + h, x:x + w], size, interpolation=cv2.INTER_AREA)
+    return np.packbits(small >= 128)
+# end function
+
+
+###################################################################################################
+class PlateCache:
+    # Cache LRU kết quả nhận dạng theo mã hash của biển số, cho LicensePlateRecognizer(cache=...).
+    # Giữ tối đa maxEntries kết quả (mã hash nằm trong 1 ma trận cấp phát sẵn), mỗi kết quả sống tối đa ttl giây.
+    # tolerance: số bit khác nhau tối đa (khoảng cách Hamming) để dùng lại kết quả, 0 = hash phải giống hệt.
+    # Kết quả lưu có thể là None (ứng viên không đủ ký tự) để lần sau cũng bỏ qua luôn.
+    # Mỗi tiến trình / thread giữ 1 cache riêng
+
+    def __init__(self, maxEntries=MAX_ENTRIES, ttl=TTL, tolerance=TOLERANCE, hashSize=HASH_SIZE):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.hashSize = hashSize
+        self.keys = np.zeros((maxEntries, hashSize[0] * hashSize[1] // 8), np.uint8)
+        self.entries = OrderedDict()        # slot -> (thời điểm lưu, kết quả), cũ nhất đứng đầu
+        self.free = list(range(maxEntries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.free = list(range(self.maxEntries - 1, -1, -1))
+
+    def hashOf(self, imgThreshplate, screenCnt):
+        return plateHash(imgThreshplate, screenCnt, self.hashSize)
+
+    def expire(self, now):
+        while self.entries:
+            slot, (stored, _) = next(iter(self.entries.items()))
+            if now - stored <= self.ttl:
+                break
+            del self.entries[slot]
+            self.free.append(slot)
+            self.evictions = self.evictions + 1
+
+    def findSlot(self, key):
+        if not self.entries:
+            return None
+        slots = np.fromiter(self.entries.keys(), np.intp, len(self.entries))
+        distances = POPCOUNT[np.bitwise_xor(self.keys[slots], key)].sum(axis=1, dtype=np.int32)
+        best = int(np.argmin(distances))
+        return int(slots[best]) if distances[best] <= self.tolerance else None
+
+    def lookup(self, key):
+        # Trả về (True, kết quả) nếu có kết quả cho biển số gần giống, (False, None) nếu không
+        self.expire(time.monotonic())
+        slot = self.findSlot(key)
+        if slot is None:
+            self.misses = self.misses + 1
+            return False, None
+        self.hits = self.hits + 1
+        self.entries.move_to_end(slot)
+        return True, self.entries[slot][1]
+
+    def store(self, key, result):
+        now = time.monotonic()
+        self.expire(now)
+        slot = self.findSlot(key)
+        if slot is not None:
+            del self.entries[slot]
+        elif self.free:
+            slot = self.free.pop()
+        else:
+            slot, _ = self.entries.popitem(last=False)    # bỏ kết quả lâu không dùng nhất
+            self.evictions = self.evictions + 1
+        self.keys[slot] = key
+        self.entries[slot] = (now, result)
+# end class
@@ -0,0 +1,243 @@
+# PlateTracker.py
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+from Geometry import plateAngles
+from Metrics import FrameRecord
+
+# module level variables ##########################################################################
+MATCH_IOU = 0.3                 # IoU tối thiểu để coi 2 vùng biển số ở 2 frame liên tiếp là 1 xe
+STABLE_IOU = 0.7                # IoU đủ cao để dùng lại kết quả OCR cũ
+CENTROID_FACTOR = 0.5           # hoặc tâm lệch ít hơn 0.5 x đường chéo của vùng biển số cũ
+MIN_CONFIDENCE = 0.75           # độ tin cậy trung bình của các ký tự thấp hơn mức này thì OCR lại ...
+MAX_READINGS = 5                # ... cho tới khi có đủ bấy nhiêu lần đọc để bầu chọn
+MAX_MISSES = 5                  # số frame liên tiếp không thấy biển số trước khi kết thúc track
+
+
+###################################################################################################
+@dataclass
+class Track:
+    track_id: int
+    quad: np.ndarray
+    first_frame: int
+    last_frame: int
+    plate: object = None        # PlateResult gần nhất
+    readings: list = field(default_factory=list)      # các lần đọc (text, confidences)
+    misses: int = 0
+    ocr_runs: int = 0
+    reused: int = 0
+    frames_since_ocr: int = 0
+
+    @property
+    def box(self):
+        return cv2.boundingRect(self.quad)
+
+    def votedText(self):
+        return voteReadings(self.readings)[0]
+# end class
+
+
+@dataclass
+class PlateEvent:
+    # 1 sự kiện cho mỗi xe, phát ra khi track kết thúc
+    track_id: int
+    text: str
+    first_line: str
+    second_line: str
+    agreement: float            # tỉ lệ lần đọc trùng với chuỗi đã bầu chọn
+    first_frame: int
+    last_frame: int
+    readings: int
+    ocr_runs: int
+# end class
+
+
+###################################################################################################
+def boxIoU(a, b):
+    (ax, ay, aw, ah) = a
+    (bx, by, bw, bh) = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+# end function
+
+
+def centroidClose(a, b, factor=CENTROID_FACTOR):
+    (ax, ay, aw, ah) = a
+    (bx, by, bw, bh) = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    return dx * dx + dy * dy <= (factor * factor) * (aw * aw + ah * ah)
+# end function
+
+
+def voteReadings(readings):
+    # Bầu chọn từng vị trí ký tự (có trọng số là độ tin cậy) trên các lần đọc có độ dài phổ biến nhất
+    if not readings:
+        return "", 0.0
+    length = Counter(len(text) for text, _ in readings).most_common(1)[0][0]
+    votes = [defaultdict(float) for _ in range(length)]
+    for text, confidences in readings:
+        if len(text) != length:
+            continue
+        for position, (char, confidence) in enumerate(zip(text, confidences)):
+            votes[position][char] += confidence if confidence > 0 else 1e-6
+    text = "".join(max(v.items(), key=lambda item: item[1])[0] for v in votes)
+    agreement = sum(1 for reading, _ in readings if reading == text) / float(len(readings))
+    return text, agreement
+# end function
+
+
+def sameVehicle(voted, text):
+    # Lần đọc mới khớp ít hơn nửa số ký tự với chuỗi đã bầu chọn thì coi là xe khác
+    if abs(len(voted) - len(text)) > 2:
+        return False
+    if len(voted) != len(text):
+        return True
+    return sum(1 for a, b in zip(voted, text) if a == b) * 2 >= len(text)
+# end function
+
+
+###################################################################################################
+class PlateTracker:
+    # Theo dõi biển số qua các frame: chỉ OCR khi có track mới, kết quả kém tin cậy hoặc biển số dịch chuyển nhiều.
+    # update() trả về (danh sách track đang thấy trong frame, danh sách PlateEvent của các xe vừa rời khỏi khung hình)
+
+    def __init__(self, recognizer, matchIoU=MATCH_IOU, stableIoU=STABLE_IOU, minConfidence=MIN_CONFIDENCE,
+                 maxReadings=MAX_READINGS, maxMisses=MAX_MISSES, refreshEvery=None):
+        self.recognizer = recognizer
+        self.matchIoU = matchIoU
+        self.stableIoU = stableIoU
+        self.minConfidence = minConfidence
+        self.maxReadings = maxReadings
+        self.maxMisses = maxMisses
+        self.refreshEvery = refreshEvery        # OCR lại sau bấy nhiêu frame dù track ổn định, None = không
+        self.tracks = []
+        self.nextId = 1
+        self.frameIndex = -1
+        self.ocrRuns = 0
+        self.reused = 0
+
+    def needsOcr(self, track, iou):
+        if track.plate is None or iou < self.stableIoU:
+            return True
+        if track.plate.confidence < self.minConfidence and len(track.readings) < self.maxReadings:
+            return True
+        return self.refreshEvery is not None and track.frames_since_ocr >= self.refreshEvery
+
+    def associate(self, boxes):
+        # Ghép tham lam theo IoU lớn nhất; nếu IoU thấp thì thử theo khoảng cách tâm
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            trackBox = track.box
+            for c, box in enumerate(boxes):
+                iou = boxIoU(trackBox, box)
+                if iou >= self.matchIoU or centroidClose(trackBox, box):
+                    pairs.append((iou, t, c))
+        pairs.sort(reverse=True)
+
+        matches = {}
+        usedTracks = set()
+        for iou, t, c in pairs:
+            if t in usedTracks or c in matches:
+                continue
+            matches[c] = (t, iou)
+            usedTracks.add(t)
+        return matches
+
+    def update(self, frame, frameIndex=None):
+        self.frameIndex = self.frameIndex + 1 if frameIndex is None else frameIndex
+        metrics = self.recognizer.metrics
+        record = FrameRecord() if metrics is not None else None
+        imgThreshplate, candidates = self.recognizer.detect(frame, record, self.recognizer.buffers)
+        reused = self.reused
+        boxes = [cv2.boundingRect(c) for c in candidates]
+        matches = self.associate(boxes)
+
+        seen = set()
+        toRead = []                             # (track hoặc None nếu là xe mới, contour)
+        for c, screenCnt in enumerate(candidates):
+            if c in matches:
+                t, iou = matches[c]
+                track = self.tracks[t]
+                seen.add(t)
+                track.quad = screenCnt.reshape(4, 2)
+                track.last_frame = self.frameIndex
+                track.misses = 0
+                if self.needsOcr(track, iou):
+                    toRead.append((track, screenCnt))
+                else:
+                    track.reused = track.reused + 1
+                    track.frames_since_ocr = track.frames_since_ocr + 1
+                    self.reused = self.reused + 1
+            elif not any(boxIoU(boxes[c], self.tracks[t].box) >= self.matchIoU for t in seen):
+                toRead.append((None, screenCnt))   # bỏ qua contour lồng trong 1 biển số đã ghép
+
+        self.readPending(frame, imgThreshplate, toRead, record)
+        if record is not None:
+            metrics.cacheHit("tracker", self.reused - reused)
+            metrics.cacheMiss("tracker", len(toRead))
+            metrics.recordFrame(record)
+
+        finished = []
+        for t, track in enumerate(self.tracks):
+            if t not in seen and track.last_frame != self.frameIndex:
+                track.misses = track.misses + 1
+        for track in [t for t in self.tracks if t.misses > self.maxMisses]:
+            self.tracks.remove(track)
+            if track.readings:
+                finished.append(self.makeEvent(track))
+
+        visible = [t for t in self.tracks if t.last_frame == self.frameIndex and t.plate is not None]
+        return visible, finished
+
+    def readPending(self, frame, imgThreshplate, toRead, record=None):
+        # OCR theo lô cho mọi biển số cần đọc trong frame
+        pendings = []
+        owners = []
+        angles = plateAngles([screenCnt for _, screenCnt in toRead]).tolist()
+        for (track, screenCnt), angle in zip(toRead, angles):
+            pending = self.recognizer.preparePlate(frame, imgThreshplate, screenCnt, record, angle)
+            if pending is not None:
+                pendings.append(pending)
+                owners.append(track)
+        plates = self.recognizer.readPlates(pendings, record)
+        self.ocrRuns = self.ocrRuns + len(plates)
+
+        for track, plate in zip(owners, plates):
+            box = cv2.boundingRect(plate.quad)
+            if track is not None and not sameVehicle(track.votedText(), plate.text):
+                track.misses = self.maxMisses + 1     # xe khác đã vào đúng vị trí cũ: kết thúc track cũ
+                track = None
+            if track is None:
+                if any(boxIoU(box, t.box) >= self.matchIoU for t in self.tracks
+                       if t.last_frame == self.frameIndex and t.misses <= self.maxMisses):
+                    continue                    # trùng với track khác đã có trong frame này
+                track = Track(self.nextId, plate.quad, self.frameIndex, self.frameIndex)
+                self.nextId = self.nextId + 1
+                self.tracks.append(track)
+            track.plate = plate
+            track.readings.append((plate.text, plate.confidences))
+            track.ocr_runs = track.ocr_runs + 1
+            track.frames_since_ocr = 0
+
+    def makeEvent(self, track):
+        text, agreement = voteReadings(track.readings)
+        split = len(track.plate.first_line) if len(track.plate.text) == len(text) else len(text)
+        first_line, second_line = text[:split], text[split:]
+        return PlateEvent(track.track_id, text, first_line, second_line, agreement, track.first_frame,
+                          track.last_frame, len(track.readings), track.ocr_runs)
+
+    def flush(self):
+        # Kết thúc mọi track còn lại (hết video)
+        finished = [self.makeEvent(t) for t in self.tracks if t.readings]
+        self.tracks = []
+        return finished
+# end class
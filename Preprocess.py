@@ -9,22 +9,64 @@ GAUSSIAN_SMOOTH_FILTER_SIZE = (5, 5) #kích cỡ càng to thì càng mờ
 ADAPTIVE_THRESH_BLOCK_SIZE = 19 
 ADAPTIVE_THRESH_WEIGHT = 9  
 
+# tophat/blackhat với kernel 3x3 lặp 10 lần tương đương 1 lần với kernel 21x21 (mỗi lần lặp nới thêm 1 điểm ảnh mỗi phía)
+MORPH_ITERATIONS = 10
+MORPH_KERNEL_SIZE = (2 * MORPH_ITERATIONS + 1, 2 * MORPH_ITERATIONS + 1)
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, MORPH_KERNEL_SIZE)
+
 ###################################################################################################
-def preprocess(imgOriginal):
+class BufferPool:
+    # Các mảng trung gian dùng lại cho mọi frame (mỗi stream / recognizer 1 pool, không dùng chung giữa các thread).
+    # Mỗi tên giữ 1 vùng nhớ chỉ lớn lên khi gặp ảnh lớn hơn, ảnh nhỏ hơn (vd các vùng của detectScale) dùng view
+    # trên vùng đó nên sau vài frame đầu không cấp phát thêm. Mảng trả về chỉ hợp lệ tới lần get() cùng tên sau
+    def __init__(self):
+        self.memory = {}
+        self.allocations = 0        # số lần phải cấp phát (hoặc cấp phát lại lớn hơn)
+
+    def get(self, name, shape, dtype=np.uint8):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        memory = self.memory.get(name)
+        if memory is None or memory.size < size:
+            memory = np.empty(size, np.uint8)
+            self.memory[name] = memory
+            self.allocations = self.allocations + 1
+        return memory[:size].view(dtype).reshape(shape)
+
+    def zeros(self, name, shape, dtype=np.uint8):
+        array = self.get(name, shape, dtype)
+        array.fill(0)
+        return array
+
+    def nbytes(self):
+        return sum(memory.size for memory in self.memory.values())
+# end class
+
+
+def poolGet(buffers, name, shape):
+    # buffers=None: để OpenCV tự cấp phát mảng mới như trước
+    return buffers.get(name, shape) if buffers is not None else None
+# end function
 
-    imgGrayscale = extractValue(imgOriginal)
+###################################################################################################
+def preprocess(imgOriginal, buffers=None):
+    # buffers: BufferPool, các ảnh trung gian và 2 ảnh trả về được ghi vào mảng của pool thay vì cấp phát mới
+    shape = imgOriginal.shape[:2]
+    if imgOriginal.ndim == 2:
+        imgGrayscale = imgOriginal # đầu vào đã là ảnh xám / kênh V
+    else:
+        imgGrayscale = extractValue(imgOriginal, buffers)
     # imgGrayscale = cv2.cvtColor(imgOriginal,cv2.COLOR_BGR2GRAY) nên dùng hệ màu HSV
     # Trả về giá trị cường độ sáng ==> ảnh gray
-    imgMaxContrastGrayscale = maximizeContrast(imgGrayscale) #để làm nổi bật biển số hơn, dễ tách khỏi nền
+    imgMaxContrastGrayscale = maximizeContrastFast(imgGrayscale, buffers) #để làm nổi bật biển số hơn, dễ tách khỏi nền
     #cv2.imwrite("imgGrayscalePlusTopHatMinusBlackHat.jpg",imgMaxContrastGrayscale)
-    height, width = imgGrayscale.shape
 
-    imgBlurred = np.zeros((height, width, 1), np.uint8)
-    imgBlurred = cv2.GaussianBlur(imgMaxContrastGrayscale, GAUSSIAN_SMOOTH_FILTER_SIZE, 0)
+    imgBlurred = cv2.GaussianBlur(imgMaxContrastGrayscale, GAUSSIAN_SMOOTH_FILTER_SIZE, 0,
+                                  dst=poolGet(buffers, "blurred", shape))
     #cv2.imwrite("gauss.jpg",imgBlurred)
     #Làm mịn ảnh bằng bộ lọc Gauss 5x5, sigma = 0
 
-    imgThresh = cv2.adaptiveThreshold(imgBlurred, 255.0, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, ADAPTIVE_THRESH_BLOCK_SIZE, ADAPTIVE_THRESH_WEIGHT)
+    imgThresh = cv2.adaptiveThreshold(imgBlurred, 255.0, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, ADAPTIVE_THRESH_BLOCK_SIZE, ADAPTIVE_THRESH_WEIGHT,
+                                      dst=poolGet(buffers, "thresh", shape))
 
     #Tạo ảnh nhị phân
     return imgGrayscale, imgThresh
@@ -32,16 +74,17 @@ def preprocess(imgOriginal):
 # end function
 
 ###################################################################################################
-def extractValue(imgOriginal):
-    height, width, numChannels = imgOriginal.shape
-    imgHSV = np.zeros((height, width, 3), np.uint8)
-    imgHSV = cv2.cvtColor(imgOriginal, cv2.COLOR_BGR2HSV)
-
-    imgHue, imgSaturation, imgValue = cv2.split(imgHSV)
-    
-    #màu sắc, độ bão hòa, giá trị cường độ sáng
+def extractValue(imgOriginal, buffers=None):
+    # Kênh V (cường độ sáng) của HSV, giống hệt cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))[2]:
+    # với ảnh 8 bit V = max(B, G, R), nên lấy thẳng từng kênh rồi cv2.max, không tạo ảnh HSV 3 kênh
+    # và 3 mảng H, S, V (nhanh hơn khoảng 3 lần)
     #Không chọn màu RBG vì vd ảnh màu đỏ sẽ còn lẫn các màu khác nữa nên khó xđ ra "một màu" 
-    return imgValue
+    shape = imgOriginal.shape[:2]
+    imgValue = cv2.extractChannel(imgOriginal, 0, dst=poolGet(buffers, "value", shape))
+    imgChannel = cv2.extractChannel(imgOriginal, 1, dst=poolGet(buffers, "channel", shape))
+    cv2.max(imgValue, imgChannel, dst=imgValue)
+    cv2.extractChannel(imgOriginal, 2, dst=imgChannel)
+    return cv2.max(imgValue, imgChannel, dst=imgValue)
 # end function
 
 ###################################################################################################
@@ -65,12 +108,19 @@ def maximizeContrast(imgGrayscale):
     return imgGrayscalePlusTopHatMinusBlackHat
 # end function
 
-
-
-
-
-
-
-
-
-
+###################################################################################################
+def maximizeContrastFast(imgGrayscale, buffers=None):
+    # Cho kết quả giống hệt maximizeContrast từng điểm ảnh (xem Benchmark.py preprocess) nhưng:
+    #  - dùng thẳng kernel 21x21 thay cho kernel 3x3 lặp 10 lần
+    #  - opening / closing ghi đè lên ảnh erode / dilate, các phép cộng trừ làm tại chỗ,
+    #    không cấp phát các mảng np.zeros không dùng tới
+    imgOpened = cv2.erode(imgGrayscale, MORPH_KERNEL, dst=poolGet(buffers, "opened", imgGrayscale.shape))
+    cv2.dilate(imgOpened, MORPH_KERNEL, dst=imgOpened)
+    imgClosed = cv2.dilate(imgGrayscale, MORPH_KERNEL, dst=poolGet(buffers, "closed", imgGrayscale.shape))
+    cv2.erode(imgClosed, MORPH_KERNEL, dst=imgClosed)
+
+    imgTopHat = cv2.subtract(imgGrayscale, imgOpened, dst=imgOpened)
+    imgGrayscalePlusTopHat = cv2.add(imgGrayscale, imgTopHat, dst=imgTopHat)
+    imgBlackHat = cv2.subtract(imgClosed, imgGrayscale, dst=imgClosed)
+    return cv2.subtract(imgGrayscalePlusTopHat, imgBlackHat, dst=imgGrayscalePlusTopHat)
+# end function
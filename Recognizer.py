@@ -0,0 +1,355 @@
+# Recognizer.py
+
+import time
+from dataclasses import dataclass, field, replace
+
+import cv2
+import numpy as np
+
+import CharClassifier
+import KnnEngine
+import ModelStore
+from Geometry import plateAngles
+import Preprocess
+from Detection import MAX_CANDIDATES, detectPlates, filterQuads, findPlateCandidates, plateContours
+from Metrics import FrameRecord
+
+# module level variables ##########################################################################
+Min_char = 0.01                 # diện tích ký tự so với diện tích biển số
+Max_char = 0.09
+
+Min_ratio_char = 0.25           # tỉ lệ rộng / cao của ký tự
+Max_ratio_char = 0.7
+
+MIN_CHARS = 7                   # biển số hợp lệ có từ 7 đến 9 ký tự
+MAX_CHARS = 9
+
+RESIZED_IMAGE_WIDTH = 20
+RESIZED_IMAGE_HEIGHT = 30
+
+KNN_K = 3
+
+# Loại sớm ứng viên trước khi xoay, phóng to và tách ký tự (theo thứ tự từ rẻ tới đắt).
+# Ngưỡng kích thước tính theo tỉ lệ với frame để dùng được ở mọi độ phân giải: trên ảnh 1920x1080 biển số thật
+# chiếm 1.3% - 4.5% frame, trên ảnh cắt sát biển số (data/image/1.1.PNG, 2.jpg) tới 25% - 65%.
+# Tỉ lệ điểm trắng của biển số thật 0.21 - 0.38
+MIN_PLATE_FRACTION = 0.0025     # vùng bao nhỏ nhất, bằng 5000 điểm ảnh (min_size_plate cũ) trên frame 1920x1080
+MAX_PLATE_FRACTION = 0.9        # vùng bao gần bằng cả frame là viền ảnh chứ không phải biển số
+MIN_FOREGROUND = 0.15           # tỉ lệ điểm trắng của ảnh nhị phân trong vùng bao
+MAX_FOREGROUND = 0.6
+CHAR_SLACK = 3                  # đếm ký tự trên vùng bao chưa xoay, nới thêm 3 ký tự mỗi phía so với MIN/MAX_CHARS
+CASCADE_STAGES = ("size", "foreground", "chars")
+
+
+###################################################################################################
+@dataclass
+class PlateResult:
+    text: str                   # first_line + second_line
+    first_line: str
+    second_line: str
+    quad: np.ndarray            # 4 góc của biển số trên ảnh gốc, shape (4, 2)
+    angle: float                # góc xoay (độ) đã dùng để làm thẳng biển số
+    chars: list = field(default_factory=list)
+    confidences: list = field(default_factory=list)   # tỉ lệ hàng xóm KNN đồng ý / xác suất CNN của từng ký tự
+    char_boxes: list = field(default_factory=list)    # (x, y, w, h) của từng ký tự trên roi
+    roi: np.ndarray = None      # ảnh biển số đã xoay và phóng to, chỉ có khi keepRoi=True
+
+    @property
+    def confidence(self):
+        return sum(self.confidences) / len(self.confidences) if self.confidences else 0.0
+# end class
+
+
+###################################################################################################
+def plateAngle(screenCnt):
+    # Lấy 2 đỉnh thấp nhất (y lớn nhất) của biển số để tính góc nghiêng (cả lô: Geometry.plateAngles)
+    return float(plateAngles(screenCnt)[0])
+# end function
+
+
+def plateBounds(screenCnt):
+    # Hàng/cột nhỏ nhất và lớn nhất của vùng biển số, giống hệt min/max của np.where trên mask đã tô contour
+    (x, y, w, h) = cv2.boundingRect(screenCnt)
+    return y, x, y + h - 1, x + w - 1
+# end function
+
+
+def warpPlate(img, screenCnt, angle):
+    # Cắt vùng bao của contour trên img, xoay cho thẳng rồi phóng to 3 lần
+    (topx, topy, bottomx, bottomy) = plateBounds(screenCnt)
+    ptPlateCenter = (bottomx - topx) / 2, (bottomy - topy) / 2
+    rotationMatrix = cv2.getRotationMatrix2D(ptPlateCenter, angle, 1.0)
+    size = (bottomy - topy, bottomx - topx)
+
+    warped = cv2.warpAffine(img[topx:bottomx + 1, topy:bottomy + 1], rotationMatrix, size)
+    return cv2.resize(warped, (0, 0), fx=3, fy=3)
+# end function
+
+
+def cropPlate(img, imgThreshplate, screenCnt, angle):
+    # Cắt biển số theo vùng bao của contour (không cần mask cả frame), xoay cho thẳng rồi phóng to 3 lần.
+    # img=None: bỏ qua ảnh màu, chỉ làm trên ảnh nhị phân (đủ cho nhận dạng)
+    imgThresh = warpPlate(imgThreshplate, screenCnt, angle)
+    if img is None:
+        return None, imgThresh
+    return warpPlate(img, screenCnt, angle), imgThresh
+# end function
+
+
+###################################################################################################
+def segmentCharacters(imgThresh):
+    # Trả về ảnh nhị phân đã dilate và bounding box các ký tự, sắp xếp từ trái sang phải
+    kerel3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    thre_mor = cv2.morphologyEx(imgThresh, cv2.MORPH_DILATE, kerel3)
+    cont, hier = cv2.findContours(thre_mor, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    char_x_ind = {}
+    char_x = []
+    height, width = imgThresh.shape[:2]
+    roiarea = height * width
+    for ind, cnt in enumerate(cont):
+        area = cv2.contourArea(cnt)
+        (x, y, w, h) = cv2.boundingRect(cont[ind])
+        ratiochar = w / h
+        if (Min_char * roiarea < area < Max_char * roiarea) and (Min_ratio_char < ratiochar < Max_ratio_char):
+            if x in char_x:  # Sử dụng để dù cho trùng x vẫn vẽ được
+                x = x + 1
+            char_x.append(x)
+            char_x_ind[x] = ind
+
+    boxes = [cv2.boundingRect(cont[char_x_ind[i]]) for i in sorted(char_x)]
+    return thre_mor, boxes
+# end function
+
+
+def flattenCharacter(thre_mor, box):
+    (x, y, w, h) = box
+    imgROI = thre_mor[y:y + h, x:x + w]  # Crop the characters
+    imgROIResized = cv2.resize(imgROI, (RESIZED_IMAGE_WIDTH, RESIZED_IMAGE_HEIGHT))  # resize image
+    npaROIResized = imgROIResized.reshape((1, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT))
+    return np.float32(npaROIResized)
+# end function
+
+
+def fillCharacters(thre_mor, boxes, npaBatch):
+    # Ghi từng ký tự (đã resize 20x30) vào 1 hàng của ma trận float32 cấp phát sẵn
+    for row, (x, y, w, h) in zip(npaBatch, boxes):
+        imgROIResized = cv2.resize(thre_mor[y:y + h, x:x + w], (RESIZED_IMAGE_WIDTH, RESIZED_IMAGE_HEIGHT))
+        row[:] = imgROIResized.reshape(-1)
+    return len(boxes)
+# end function
+
+
+def splitLines(chars, boxes, height):
+    first_line = ""
+    second_line = ""
+    for strCurrentChar, (x, y, w, h) in zip(chars, boxes):
+        if (y < height / 3):  # decide 1 or 2-line license plate
+            first_line = first_line + strCurrentChar
+        else:
+            second_line = second_line + strCurrentChar
+    return first_line, second_line
+# end function
+
+
+def rejectStage(imgThreshplate, screenCnt):
+    # Tên bước loại ứng viên (CASCADE_STAGES), None nếu ứng viên qua hết các bước
+    (x, y, w, h) = cv2.boundingRect(screenCnt)
+    if not MIN_PLATE_FRACTION * imgThreshplate.size <= w * h <= MAX_PLATE_FRACTION * imgThreshplate.size:
+        return "size"
+    crop = imgThreshplate[y:y + h, x:x + w]
+    if not MIN_FOREGROUND <= cv2.countNonZero(crop) / float(w * h) <= MAX_FOREGROUND:
+        return "foreground"
+    _, boxes = segmentCharacters(crop)
+    if not MIN_CHARS - CHAR_SLACK <= len(boxes) <= MAX_CHARS + CHAR_SLACK:
+        return "chars"
+    return None
+# end function
+
+
+###################################################################################################
+class PendingPlate:
+    # Biển số đã cắt và tách ký tự, đang chờ nhận dạng ký tự theo lô.
+    # key: mã hash trong PlateCache để lưu kết quả; cached: kết quả lấy từ cache, không cần nhận dạng nữa
+    def __init__(self, screenCnt, angle, roi, imgThresh, thre_mor, boxes, key=None, cached=None):
+        self.screenCnt = screenCnt
+        self.angle = angle
+        self.roi = roi
+        self.imgThresh = imgThresh
+        self.thre_mor = thre_mor
+        self.boxes = boxes
+        self.key = key
+        self.cached = cached
+# end class
+
+
+###################################################################################################
+class LicensePlateRecognizer:
+    # Nạp model KNN 1 lần, sau đó gọi recognize(frame) cho từng ảnh / frame BGR
+    # Không dùng chung 1 đối tượng giữa nhiều thread (ma trận npaBatch được tái sử dụng)
+
+    # backend: "opencv" (cv2.ml.KNearest) hoặc "numpy" (KnnEngine.NumpyKNearest, cho kết quả giống hệt)
+    # detectScale: tìm thô trên ảnh thu nhỏ theo tỉ lệ này rồi chỉ xử lý các vùng tìm được (ảnh độ phân giải cao)
+    # roi: (x, y, w, h) vùng cố định của camera cần tìm biển số, None = cả frame
+    # metrics: Metrics.PipelineMetrics để đo thời gian từng bước và đếm ứng viên, None = không đo gì.
+    # cascade: loại sớm ứng viên bằng rejectStage() trước khi cắt và tách ký tự (số ứng viên mỗi bước loại được
+    # đếm trong metrics là rejected_size / rejected_foreground / rejected_chars)
+    # cache: PlateCache.PlateCache dùng lại kết quả của biển số gần giống đã đọc, None = luôn đọc lại
+    # classifier: None = KNN (mặc định), đường dẫn file .onnx của TrainCnn.py = CharClassifier.CnnClassifier chạy
+    # bằng classifierEngine ("opencv" / "onnxruntime"), hoặc 1 đối tượng có hàm classify(npaBatch)
+    # Các hàm detect / preparePlate / readPlates nhận thêm record (FrameRecord) để ghi số liệu của frame hiện tại
+
+    def __init__(self, modelPath=ModelStore.MODEL_FILE, model=None, keepRoi=False, backend="opencv", dtype="float32",
+                 detectScale=None, roi=None, metrics=None, cascade=True,
+                 cache=None, classifier=None, classifierEngine="opencv"):
+        # Model KNN chỉ được nạp khi dùng KNN, với CNN thì modelPath / backend / dtype không dùng tới
+        self.model = model
+        self.kNearest = None
+        if classifier is None:
+            self.model = model if model is not None else ModelStore.loadModel(modelPath)
+            self.kNearest = KnnEngine.createKNearest(self.model, backend, dtype)
+        self.classifier = CharClassifier.createClassifier(classifier, self.kNearest, KNN_K, classifierEngine)
+        self.keepRoi = keepRoi
+        self.detectScale = detectScale
+        self.roi = roi
+        self.metrics = metrics
+        self.cascade = cascade
+        self.cache = cache
+        self.buffers = Preprocess.BufferPool()  # các ảnh cỡ frame được dùng lại cho mọi frame của recognizer này
+        # đủ chỗ cho mọi ký tự của mọi ứng viên trong 1 frame
+        self.npaBatch = np.empty((MAX_CANDIDATES * MAX_CHARS, RESIZED_IMAGE_WIDTH * RESIZED_IMAGE_HEIGHT), np.float32)
+
+    def detect(self, frame, record=None, buffers=None):
+        # buffers: BufferPool cho các ảnh trung gian (recognize() dùng self.buffers); khi đó ảnh nhị phân trả về
+        # bị ghi đè ở frame sau. Mặc định cấp phát mảng mới để kết quả giữ lại được lâu
+        if record is None:
+            return detectPlates(frame, self.detectScale, self.roi, buffers=buffers)
+
+        start = time.perf_counter()
+        if self.detectScale is not None or self.roi is not None:
+            imgThreshplate, candidates = detectPlates(frame, self.detectScale, self.roi, buffers=buffers)
+            record.stages["detect"] += time.perf_counter() - start
+        else:
+            _, imgThreshplate = Preprocess.preprocess(frame, buffers)
+            lap = time.perf_counter()
+            record.stages["preprocess"] += lap - start
+            contours = plateContours(imgThreshplate, buffers=buffers)
+            start = time.perf_counter()
+            record.stages["contours"] += start - lap
+            candidates = filterQuads(contours)
+            record.stages["quad_filter"] += time.perf_counter() - start
+            record.counts["contours"] += len(contours)
+        record.counts["quads"] += len(candidates)
+        return imgThreshplate, candidates
+
+    def classifyBatch(self, npaBatch):
+        # 1 lần gọi bộ phân loại (KNN / CNN) cho cả lô ký tự
+        return self.classifier.classify(npaBatch)
+
+    def preparePlate(self, frame, imgThreshplate, screenCnt, record=None, angle=None):
+        # angle: góc nghiêng đã tính sẵn cho cả frame bằng Geometry.plateAngles, None = tự tính
+        if record is not None:
+            start = time.perf_counter()
+        if self.cascade:
+            stage = rejectStage(imgThreshplate, screenCnt)
+            if record is not None:
+                lap = time.perf_counter()
+                record.stages["cascade"] += lap - start
+                start = lap
+            if stage is not None:
+                if record is not None:
+                    record.counts["rejected_" + stage] += 1
+                return None
+        if angle is None:
+            angle = plateAngle(screenCnt)
+        key = None
+        if self.cache is not None:
+            key = self.cache.hashOf(imgThreshplate, screenCnt)
+            found, cached = self.cache.lookup(key)
+            if self.metrics is not None:
+                (self.metrics.cacheHit if found else self.metrics.cacheMiss)("plate_cache")
+            if record is not None:
+                lap = time.perf_counter()
+                record.stages["cache"] += lap - start
+                start = lap
+            if found:
+                if cached is None:
+                    return None
+                if record is not None:
+                    record.counts["plates"] += 1
+                # roi cắt lại từ frame hiện tại: roi trong cache là của frame cũ, ở vị trí khác
+                roi = warpPlate(frame, screenCnt, angle) if self.keepRoi else None
+                return PendingPlate(screenCnt, angle, roi, None, None, [], cached=cached)
+        roi, imgThresh = cropPlate(frame if self.keepRoi else None, imgThreshplate, screenCnt, angle)
+        if record is not None:
+            lap = time.perf_counter()
+            record.stages["deskew"] += lap - start
+        thre_mor, boxes = segmentCharacters(imgThresh)
+        if record is not None:
+            record.stages["segmentation"] += time.perf_counter() - lap
+        if not MIN_CHARS <= len(boxes) <= MAX_CHARS:
+            if key is not None:
+                self.cache.store(key, None)
+            return None
+        if record is not None:
+            record.counts["plates"] += 1
+        return PendingPlate(screenCnt, angle, roi, imgThresh, thre_mor, boxes, key)
+
+    def finishPlate(self, pending, chars, confidences):
+        first_line, second_line = splitLines(chars, pending.boxes, pending.imgThresh.shape[0])
+        return PlateResult(first_line + second_line, first_line, second_line, pending.screenCnt.reshape(4, 2),
+                           pending.angle, chars, confidences, pending.boxes, pending.roi)
+
+    def readPlates(self, pendings, record=None):
+        # Gom ký tự của tất cả biển số vào 1 ma trận, nhận dạng 1 lần rồi chia kết quả lại cho từng biển
+        # Biển số lấy từ cache không có ký tự nào trong lô, chỉ thay toạ độ và góc của frame hiện tại
+        if not pendings:
+            return []
+        total = sum(len(p.boxes) for p in pendings)
+        if record is not None:
+            begin = time.perf_counter()
+            record.counts["chars"] += total
+        if total > len(self.npaBatch):
+            self.npaBatch = np.empty((total, self.npaBatch.shape[1]), np.float32)
+
+        start = 0
+        for pending in pendings:
+            start += fillCharacters(pending.thre_mor, pending.boxes, self.npaBatch[start:])
+        chars, confidences = self.classifyBatch(self.npaBatch[:total]) if total else ([], [])
+
+        results = []
+        start = 0
+        for pending in pendings:
+            if pending.cached is not None:
+                results.append(replace(pending.cached, quad=pending.screenCnt.reshape(4, 2), angle=pending.angle,
+                                       roi=pending.roi))
+                continue
+            end = start + len(pending.boxes)
+            results.append(self.finishPlate(pending, chars[start:end], confidences[start:end]))
+            if pending.key is not None:
+                self.cache.store(pending.key, results[-1])
+            start = end
+        if record is not None:
+            record.stages["knn"] += time.perf_counter() - begin
+        return results
+
+    def readPlate(self, frame, imgThreshplate, screenCnt):
+        pending = self.preparePlate(frame, imgThreshplate, screenCnt)
+        if pending is None:
+            return None
+        return self.readPlates([pending])[0]
+
+    def recognize(self, frame):
+        record = FrameRecord() if self.metrics is not None else None
+        imgThreshplate, candidates = self.detect(frame, record, self.buffers)
+        angles = plateAngles(candidates).tolist()
+        pendings = []
+        for screenCnt, angle in zip(candidates, angles):
+            pending = self.preparePlate(frame, imgThreshplate, screenCnt, record, angle)
+            if pending is not None:
+                pendings.append(pending)
+        plates = self.readPlates(pendings, record)
+        if record is not None:
+            self.metrics.recordFrame(record)
+        return plates
+# end class
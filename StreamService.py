@@ -0,0 +1,339 @@
+# StreamService.py
+
+import argparse
+import asyncio
+import concurrent.futures
+import glob
+import inspect
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import cv2
+
+import CharClassifier
+import KnnEngine
+import ModelStore
+from Recognizer import LicensePlateRecognizer
+
+# module level variables ##########################################################################
+QUEUE_FRAMES = 2                # số frame chờ tối đa của mỗi stream
+RECENT_ERRORS = 20              # số lỗi gần nhất giữ lại mỗi stream (stream chạy mãi không được giữ hết)
+EXECUTORS = ("process", "thread")
+
+workerRecognizer = None         # LicensePlateRecognizer của mỗi tiến trình worker (executor="process")
+threadState = threading.local()  # ... hoặc của mỗi thread (executor="thread"), vì npaBatch không dùng chung được
+
+
+###################################################################################################
+class FileSource:
+    # Video file hoặc URL (rtsp://...) mà cv2.VideoCapture mở được.
+    # realtime=True: đọc file đúng tốc độ fps của nó, giả lập 1 camera thật.
+    # live: camera thật / giả lập thì bỏ frame khi không kịp xử lý, file thường thì đọc chậm lại chờ nhận dạng
+    def __init__(self, path, realtime=False):
+        self.path = path
+        self.realtime = realtime
+        self.live = realtime or "://" in path
+        self.cap = None
+        self.fps = None
+
+    def open(self):
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            raise IOError("cannot open video source %r" % self.path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if self.realtime and fps > 0 else None
+
+    def read(self):
+        ret, img = self.cap.read()
+        return img if ret else None
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+# end class
+
+
+class SyntheticSource:
+    # Camera giả để chạy offline: lặp lại 1 danh sách frame với tốc độ fps (None hoặc 0 = nhanh nhất có thể,
+    # không phải nguồn live nên không bỏ frame)
+    def __init__(self, frames, fps=25.0, count=None):
+        self.frames = frames
+        self.fps = fps or None
+        self.count = count
+        self.index = 0
+        self.live = self.fps is not None
+
+    def open(self):
+        if not self.frames:
+            raise ValueError("synthetic source needs at least one frame")
+
+    def read(self):
+        if self.count is not None and self.index >= self.count:
+            return None
+        img = self.frames[self.index % len(self.frames)]
+        self.index = self.index + 1
+        return img
+
+    def close(self):
+        pass
+# end class
+
+
+@dataclass
+class PlateDetection:
+    stream: str
+    frame_index: int
+    timestamp: float            # time.time() lúc đọc frame
+    latency: float              # giây từ lúc đọc frame tới lúc có kết quả
+    plates: list                # danh sách PlateResult
+
+
+@dataclass
+class StreamStats:
+    read: int = 0
+    processed: int = 0
+    dropped: int = 0            # frame bị bỏ vì xử lý không kịp
+    plates: int = 0
+    errors: int = 0             # tổng số frame nhận dạng lỗi
+    recent_errors: deque = field(default_factory=lambda: deque(maxlen=RECENT_ERRORS))
+# end class
+
+
+###################################################################################################
+def initWorker(recognizerOptions):
+    global workerRecognizer
+    cv2.setNumThreads(1)
+    workerRecognizer = LicensePlateRecognizer(**recognizerOptions)
+# end function
+
+
+def recognizeInProcess(frame, roi):
+    # Recognizer của worker dùng chung cho mọi stream nhưng mỗi lúc chỉ nhận dạng 1 frame: đặt roi của stream trước
+    workerRecognizer.roi = roi
+    return workerRecognizer.recognize(frame)
+# end function
+
+
+def recognizeInThread(recognizerOptions, frame, roi):
+    if getattr(threadState, "recognizer", None) is None:
+        threadState.recognizer = LicensePlateRecognizer(**recognizerOptions)
+    threadState.recognizer.roi = roi
+    return threadState.recognizer.recognize(frame)
+# end function
+
+
+###################################################################################################
+class StreamService:
+    # Nhận dạng biển số trên nhiều nguồn video cùng lúc bằng asyncio.
+    # Mỗi stream có 1 task đọc (giải mã trong thread riêng) và 1 task nhận dạng (chạy trong executor),
+    # nối với nhau bằng hàng đợi queueSize frame; mỗi stream chỉ có 1 frame đang xử lý.
+    # Khi nhận dạng không theo kịp: nguồn live (camera) bỏ frame cũ nhất để kết quả luôn bám theo frame mới nhất,
+    # nguồn không live (file) thì task đọc chờ hàng đợi có chỗ (backpressure), không mất frame nào.
+    # Kết quả (PlateDetection) được gửi cho callback(detection) (hàm thường hoặc async) nếu có,
+    # nếu không thì được đưa vào hàng đợi self.results.
+
+    def __init__(self, workers=None, executor="process", recognizerOptions=None, queueSize=QUEUE_FRAMES,
+                 callback=None, publishEmpty=False):
+        if executor not in EXECUTORS:
+            raise ValueError("unknown executor %r, expected one of %s" % (executor, ", ".join(EXECUTORS)))
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.recognizerOptions = recognizerOptions or {}
+        self.queueSize = queueSize
+        self.callback = callback
+        self.publishEmpty = publishEmpty        # gửi cả kết quả của frame không có biển số
+        self.results = asyncio.Queue()
+        self.sources = {}
+        self.dropFrames = {}
+        self.rois = {}
+        self.stats = {}
+        self.stopping = None
+
+    def addStream(self, name, source, dropFrames=None, roi=None):
+        # roi=(x, y, w, h): vùng cố định của camera này (LicensePlateRecognizer(roi=...)),
+        # None = recognizerOptions["roi"] chung cho mọi stream (mặc định cả frame)
+        if name in self.sources:
+            raise ValueError("duplicate stream name %r" % name)
+        self.sources[name] = source
+        self.dropFrames[name] = getattr(source, "live", True) if dropFrames is None else dropFrames
+        self.rois[name] = tuple(roi) if roi is not None else self.recognizerOptions.get("roi")
+        self.stats[name] = StreamStats()
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    def createExecutor(self):
+        if self.executor == "thread":
+            return concurrent.futures.ThreadPoolExecutor(self.workers)
+        return concurrent.futures.ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"), initWorker,
+                                                      (self.recognizerOptions,))
+
+    async def publish(self, detection):
+        if self.callback is None:
+            await self.results.put(detection)
+            return
+        result = self.callback(detection)
+        if inspect.isawaitable(result):
+            await result
+
+    async def readStream(self, name, source, frames, decoder):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[name]
+        start = time.perf_counter()
+        ended = False
+        try:
+            while not self.stopping.is_set():
+                img = await loop.run_in_executor(decoder, source.read)
+                if img is None:
+                    break
+                item = (stats.read, time.time(), time.perf_counter(), img)
+                if not self.dropFrames[name]:
+                    await frames.put(item)
+                else:
+                    if frames.full():
+                        frames.get_nowait()     # bỏ frame cũ nhất, không chặn camera
+                        stats.dropped = stats.dropped + 1
+                    frames.put_nowait(item)
+                stats.read = stats.read + 1
+                if source.fps:
+                    delay = start + stats.read / source.fps - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+            await frames.put(None)              # báo hết frame cho task nhận dạng
+            ended = True
+        finally:
+            if not ended:                       # bị huỷ / lỗi: không chờ được nữa, nhường chỗ cho None
+                if frames.full():
+                    frames.get_nowait()
+                    stats.dropped = stats.dropped + 1
+                frames.put_nowait(None)
+
+    async def recognizeStream(self, name, frames, pool):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[name]
+        roi = self.rois[name]
+        while True:
+            item = await frames.get()
+            if item is None:
+                break
+            index, timestamp, readAt, img = item
+            try:
+                if self.executor == "thread":
+                    plates = await loop.run_in_executor(pool, recognizeInThread, self.recognizerOptions, img,
+                                                        roi)
+                else:
+                    plates = await loop.run_in_executor(pool, recognizeInProcess, img, roi)
+            except Exception as e:
+                stats.errors = stats.errors + 1
+                stats.recent_errors.append("frame %d: %s: %s" % (index, type(e).__name__, e))
+                continue
+            stats.processed = stats.processed + 1
+            stats.plates = stats.plates + len(plates)
+            if plates or self.publishEmpty:
+                await self.publish(PlateDetection(name, index, timestamp, time.perf_counter() - readAt, plates))
+
+    async def run(self):
+        # Chạy cho tới khi mọi nguồn hết frame hoặc stop() được gọi
+        if not self.sources:
+            raise ValueError("no streams added")
+        # Chỉ KNN cần model: với classifier (CNN) không nạp, không biên dịch lại knn_model.bin
+        if "model" not in self.recognizerOptions and self.recognizerOptions.get("classifier") is None:
+            ModelStore.loadModel(self.recognizerOptions.get("modelPath", ModelStore.MODEL_FILE))   # lỗi model báo ngay
+        self.stopping = asyncio.Event()
+        decoder = concurrent.futures.ThreadPoolExecutor(len(self.sources))
+        pool = self.createExecutor()
+        tasks = []
+        try:
+            for name, source in self.sources.items():
+                source.open()
+                frames = asyncio.Queue(self.queueSize)
+                tasks.append(asyncio.create_task(self.readStream(name, source, frames, decoder)))
+                tasks.append(asyncio.create_task(self.recognizeStream(name, frames, pool)))
+            await asyncio.gather(*tasks)
+        finally:
+            self.stopping.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            pool.shutdown(wait=True, cancel_futures=True)
+            decoder.shutdown(wait=True)
+            for source in self.sources.values():
+                source.close()
+# end class
+
+
+###################################################################################################
+async def runService(args):
+    options = {"backend": args.backend,
+               "classifier": os.path.abspath(args.classifier) if args.classifier else None,
+               "classifierEngine": args.classifier_engine}
+    service = StreamService(args.workers, args.executor, options, args.queue_size,
+                            callback=lambda d: print("[%s] frame %d: %s (%.0f ms)" % (
+                                d.stream, d.frame_index, ", ".join(p.first_line + " - " + p.second_line
+                                                                   for p in d.plates), 1e3 * d.latency)))
+    rois = {stream: (x, y, w, h) for stream, x, y, w, h in args.roi}
+    for n, source in enumerate(args.sources):
+        service.addStream("%d:%s" % (n, os.path.basename(source)), FileSource(source, realtime=args.realtime),
+                          roi=rois.get(n))
+    if args.synthetic:
+        frames = [cv2.resize(cv2.imread(path), dsize=(1920, 1080)) for path in sorted(glob.glob(args.images))]
+        for n in range(args.synthetic):
+            service.addStream("synthetic-%d" % n, SyntheticSource(frames[n:] + frames[:n], args.fps or None, args.frames),
+                              roi=rois.get(len(args.sources) + n))
+
+    start = time.perf_counter()
+    runner = asyncio.create_task(service.run())
+    if args.duration:
+        done, _ = await asyncio.wait([runner], timeout=args.duration)
+        if not done:
+            service.stop()
+    await runner
+    elapsed = time.perf_counter() - start
+
+    for name, stats in service.stats.items():
+        print("%-28s read %5d  processed %5d  dropped %5d  plates %5d  errors %d" % (
+            name, stats.read, stats.processed, stats.dropped, stats.plates, stats.errors))
+    processed = sum(s.processed for s in service.stats.values())
+    print("%d frames recognized in %.2f s, %.1f frames/sec over %d streams" % (processed, elapsed, processed / elapsed,
+                                                                             len(service.stats)))
+# end function
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognize plates on many video streams at once (asyncio)")
+    parser.add_argument("sources", nargs="*", help="video files or stream URLs (rtsp://...)")
+    parser.add_argument("--synthetic", type=int, default=0, help="add N synthetic cameras looping over --images")
+    parser.add_argument("--images", default="data/image/*.jpg")
+    parser.add_argument("--fps", type=float, default=25.0,
+                        help="frame rate of the synthetic cameras, 0 = as fast as possible (no frames dropped)")
+    parser.add_argument("--frames", type=int, default=None, help="frames per synthetic camera, default endless")
+    parser.add_argument("--realtime", action="store_true", help="read video files at their own frame rate")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--executor", choices=EXECUTORS, default="process")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_FRAMES, help="frames buffered per stream")
+    parser.add_argument("--backend", choices=KnnEngine.BACKENDS, default="opencv")
+    parser.add_argument("--roi", type=int, nargs=5, action="append", default=[],
+                        metavar=("STREAM", "X", "Y", "W", "H"),
+                        help="only look for plates inside this region of stream STREAM (0-based, sources first, "
+                             "then synthetic cameras), repeat for each camera")
+    parser.add_argument("--classifier", default=None, help="ONNX character CNN from TrainCnn.py, default: KNN")
+    parser.add_argument("--classifier-engine", choices=CharClassifier.ENGINES, default="opencv",
+                        help="runtime for --classifier")
+    args = parser.parse_args()
+    if not args.sources and not args.synthetic:
+        parser.error("give at least one source or --synthetic N")
+    if not args.duration and args.synthetic and args.frames is None:
+        parser.error("synthetic cameras never end, give --frames or --duration")
+    asyncio.run(runService(args))
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,335 @@
+# TrainCnn.py
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import CharClassifier
+import KnnEngine
+import ModelCompact
+import ModelStore
+
+# module level variables ##########################################################################
+RESIZED_IMAGE_WIDTH = 20
+RESIZED_IMAGE_HEIGHT = 30
+CNN_FILE = "char_cnn.onnx"
+
+# conv 3x3 (8) -> maxpool 2 -> conv 3x3 (16) -> maxpool 2 -> dense 64 -> dense (số nhãn) -> softmax
+CONV_CHANNELS = (8, 16)
+HIDDEN = 64
+EPOCHS = 20
+BATCH_SIZE = 64
+LEARNING_RATE = 0.002           # Adam
+WEIGHT_DECAY = 1e-4
+SCALE = 1.0 / 255               # điểm ảnh 0..255 -> 0..1 trước khi vào mạng
+
+ONNX_OPSET = 13
+ONNX_IR_VERSION = 7
+ONNX_FLOAT = 1                  # TensorProto.FLOAT
+ONNX_ATTRIBUTE_INT = 2          # AttributeProto.INT
+ONNX_ATTRIBUTE_INTS = 7         # AttributeProto.INTS
+
+
+###################################################################################################
+def im2col(x):
+    # (N, C, H, W) -> (N * H * W, C * 9): mỗi hàng là vùng 3x3 (đệm 1 điểm ảnh) quanh 1 điểm, để conv = 1 phép nhân
+    # ma trận
+    padded = np.pad(x, ((0, 0), (0, 0), (1, 1), (1, 1)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (3, 3), axis=(2, 3))   # (N, C, H, W, 3, 3)
+    (n, c, h, w) = x.shape
+    return windows.transpose(0, 2, 3, 1, 4, 5).reshape(n * h * w, c * 9)
+# end function
+
+
+def col2im(cols, shape):
+    # Ngược của im2col khi lan truyền ngược: cộng dồn gradient của các vùng 3x3 chồng lên nhau
+    (n, c, h, w) = shape
+    cols = cols.reshape(n, h, w, c, 3, 3)
+    padded = np.zeros((n, c, h + 2, w + 2), cols.dtype)
+    for i in range(3):
+        for j in range(3):
+            padded[:, :, i:i + h, j:j + w] += cols[:, :, :, :, i, j].transpose(0, 3, 1, 2)
+    return padded[:, :, 1:-1, 1:-1]
+# end function
+
+
+def maxPool(x):
+    # Max pooling 2x2 bước 2, bỏ hàng / cột lẻ cuối cùng giống MaxPool của ONNX
+    (n, c, h, w) = x.shape
+    cropped = x[:, :, :h // 2 * 2, :w // 2 * 2]
+    pooled = cropped.reshape(n, c, h // 2, 2, w // 2, 2).max(axis=(3, 5))
+    return pooled, cropped
+# end function
+
+
+def maxPoolBackward(grad, cropped, pooled, shape):
+    mask = cropped == pooled.repeat(2, axis=2).repeat(2, axis=3)
+    full = np.zeros(shape, grad.dtype)
+    full[:, :, :cropped.shape[2], :cropped.shape[3]] = mask * grad.repeat(2, axis=2).repeat(2, axis=3)
+    return full
+# end function
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+# end function
+
+
+###################################################################################################
+class CharCnn:
+    # Mạng nhỏ huấn luyện bằng NumPy (không cần framework deep learning), trọng số theo bố cục của ONNX:
+    # conv (out, in, 3, 3), dense (out, in) dùng với Gemm transB=1
+
+    def __init__(self, classes, seed=0):
+        rng = np.random.default_rng(seed)
+        (c1, c2) = CONV_CHANNELS
+        flat = c2 * (RESIZED_IMAGE_HEIGHT // 4) * (RESIZED_IMAGE_WIDTH // 4)
+
+        def he(shape, fanIn):
+            return (rng.standard_normal(shape) * np.sqrt(2.0 / fanIn)).astype(np.float32)
+
+        self.params = {"conv1_w": he((c1, 1, 3, 3), 9), "conv1_b": np.zeros(c1, np.float32),
+                       "conv2_w": he((c2, c1, 3, 3), c1 * 9), "conv2_b": np.zeros(c2, np.float32),
+                       "dense1_w": he((HIDDEN, flat), flat), "dense1_b": np.zeros(HIDDEN, np.float32),
+                       "dense2_w": he((classes, HIDDEN), HIDDEN), "dense2_b": np.zeros(classes, np.float32)}
+
+    def conv(self, x, name):
+        weight = self.params[name + "_w"]
+        cols = im2col(x)
+        out = cols @ weight.reshape(len(weight), -1).T + self.params[name + "_b"]
+        (n, _, h, w) = x.shape
+        return out.reshape(n, h, w, -1).transpose(0, 3, 1, 2), cols
+
+    def forward(self, x):
+        # x: (N, 1, 30, 20) đã nhân SCALE. Trả về logits và các giá trị trung gian cho backward
+        cache = {"x": x}
+        h, cache["cols1"] = self.conv(x, "conv1")
+        cache["relu1"] = h = np.maximum(h, 0)
+        h, cache["crop1"] = maxPool(h)
+        cache["pool1"] = h
+        h, cache["cols2"] = self.conv(h, "conv2")
+        cache["relu2"] = h = np.maximum(h, 0)
+        h, cache["crop2"] = maxPool(h)
+        cache["pool2"] = h
+        cache["flat"] = h = h.reshape(len(h), -1)
+        h = h @ self.params["dense1_w"].T + self.params["dense1_b"]
+        cache["hidden"] = h = np.maximum(h, 0)
+        return h @ self.params["dense2_w"].T + self.params["dense2_b"], cache
+
+    def backward(self, grad, cache):
+        # grad: d(loss)/d(logits). Trả về gradient của từng tham số
+        p = self.params
+        grads = {"dense2_w": grad.T @ cache["hidden"], "dense2_b": grad.sum(axis=0)}
+        grad = (grad @ p["dense2_w"]) * (cache["hidden"] > 0)
+        grads["dense1_w"] = grad.T @ cache["flat"]
+        grads["dense1_b"] = grad.sum(axis=0)
+        grad = (grad @ p["dense1_w"]).reshape(cache["pool2"].shape)
+        grad = maxPoolBackward(grad, cache["crop2"], cache["pool2"], cache["relu2"].shape) * (cache["relu2"] > 0)
+        grad = grad.transpose(0, 2, 3, 1).reshape(-1, grad.shape[1])
+        grads["conv2_w"] = (grad.T @ cache["cols2"]).reshape(p["conv2_w"].shape)
+        grads["conv2_b"] = grad.sum(axis=0)
+        grad = col2im(grad @ p["conv2_w"].reshape(len(p["conv2_w"]), -1), cache["pool1"].shape)
+        grad = maxPoolBackward(grad, cache["crop1"], cache["pool1"], cache["relu1"].shape) * (cache["relu1"] > 0)
+        grad = grad.transpose(0, 2, 3, 1).reshape(-1, grad.shape[1])
+        grads["conv1_w"] = (grad.T @ cache["cols1"]).reshape(p["conv1_w"].shape)
+        grads["conv1_b"] = grad.sum(axis=0)
+        return grads
+
+    def predict(self, x, batchSize=1024):
+        return np.concatenate([softmax(self.forward(x[i:i + batchSize])[0]) for i in range(0, len(x), batchSize)])
+# end class
+
+
+def toImages(samples):
+    return (np.asarray(samples, np.float32) * np.float32(SCALE)).reshape(-1, 1, RESIZED_IMAGE_HEIGHT,
+                                                                         RESIZED_IMAGE_WIDTH)
+# end function
+
+
+def train(samples, targets, classes, epochs=EPOCHS, seed=0, log=None):
+    # Adam + cross entropy trên các lô BATCH_SIZE ký tự xáo trộn mỗi epoch
+    rng = np.random.default_rng(seed)
+    images = toImages(samples)
+    net = CharCnn(classes, seed)
+    moments = {name: (np.zeros_like(a), np.zeros_like(a)) for name, a in net.params.items()}
+    (beta1, beta2) = (0.9, 0.999)
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(len(images))
+        loss = 0.0
+        for start in range(0, len(order), BATCH_SIZE):
+            batch = order[start:start + BATCH_SIZE]
+            logits, cache = net.forward(images[batch])
+            probabilities = softmax(logits)
+            loss += -np.log(probabilities[np.arange(len(batch)), targets[batch]] + 1e-12).sum()
+            probabilities[np.arange(len(batch)), targets[batch]] -= 1
+            grads = net.backward(probabilities / len(batch), cache)
+            step = step + 1
+            for name, grad in grads.items():
+                grad = grad + WEIGHT_DECAY * net.params[name]
+                (m, v) = moments[name]
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad * grad
+                update = LEARNING_RATE * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + 1e-8)
+                net.params[name] -= update.astype(np.float32)
+        if log is not None:
+            log("epoch %d/%d  loss %.4f" % (epoch + 1, epochs, loss / len(order)))
+    return net
+# end function
+
+
+###################################################################################################
+# Ghi file ONNX trực tiếp theo định dạng protobuf (chỉ vài message cần dùng), không cần gói onnx.
+# Nếu có cài onnx thì file ghi ra được kiểm tra lại bằng onnx.checker
+def protoVarint(value):
+    value &= (1 << 64) - 1          # số âm: bù 2 trên 64 bit như int64 của protobuf
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+# end function
+
+
+def protoInt(number, value):
+    return protoVarint(number << 3) + protoVarint(value)
+# end function
+
+
+def protoBytes(number, data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return protoVarint(number << 3 | 2) + protoVarint(len(data)) + data
+# end function
+
+
+def onnxTensor(name, array):
+    array = np.ascontiguousarray(array, "<f4")
+    return b"".join([protoInt(1, d) for d in array.shape] + [protoInt(2, ONNX_FLOAT), protoBytes(8, name),
+                                                            protoBytes(9, array.tobytes())])
+# end function
+
+
+def onnxAttribute(name, value):
+    if isinstance(value, int):
+        return protoBytes(1, name) + protoInt(3, value) + protoInt(20, ONNX_ATTRIBUTE_INT)
+    return protoBytes(1, name) + b"".join(protoInt(8, v) for v in value) + protoInt(20, ONNX_ATTRIBUTE_INTS)
+# end function
+
+
+def onnxNode(opType, inputs, output, **attributes):
+    return b"".join([protoBytes(1, name) for name in inputs] + [protoBytes(2, output), protoBytes(3, output),
+                                                                protoBytes(4, opType)] +
+                    [protoBytes(5, onnxAttribute(name, value)) for name, value in attributes.items()])
+# end function
+
+
+def onnxValueInfo(name, dims):
+    # dims: None = kích thước tuỳ ý (số ký tự trong lô)
+    shape = b"".join(protoBytes(1, protoBytes(2, "batch") if d is None else protoInt(1, d)) for d in dims)
+    tensorType = protoInt(1, ONNX_FLOAT) + protoBytes(2, shape)
+    return protoBytes(1, name) + protoBytes(2, protoBytes(1, tensorType))
+# end function
+
+
+def onnxModel(net, labels):
+    p = net.params
+    nodes = [onnxNode("Conv", [CharClassifier.CNN_INPUT, "conv1_w", "conv1_b"], "conv1", kernel_shape=[3, 3],
+                      pads=[1, 1, 1, 1]),
+             onnxNode("Relu", ["conv1"], "relu1"),
+             onnxNode("MaxPool", ["relu1"], "pool1", kernel_shape=[2, 2], strides=[2, 2]),
+             onnxNode("Conv", ["pool1", "conv2_w", "conv2_b"], "conv2", kernel_shape=[3, 3], pads=[1, 1, 1, 1]),
+             onnxNode("Relu", ["conv2"], "relu2"),
+             onnxNode("MaxPool", ["relu2"], "pool2", kernel_shape=[2, 2], strides=[2, 2]),
+             onnxNode("Flatten", ["pool2"], "flat", axis=1),
+             onnxNode("Gemm", ["flat", "dense1_w", "dense1_b"], "dense1", transB=1),
+             onnxNode("Relu", ["dense1"], "hidden"),
+             onnxNode("Gemm", ["hidden", "dense2_w", "dense2_b"], "logits", transB=1),
+             onnxNode("Softmax", ["logits"], CharClassifier.CNN_OUTPUT, axis=1)]
+    graph = b"".join([protoBytes(1, node) for node in nodes] + [protoBytes(2, "char_cnn")] +
+                     [protoBytes(5, onnxTensor(name, a)) for name, a in p.items()] +
+                     [protoBytes(11, onnxValueInfo(CharClassifier.CNN_INPUT,
+                                                   [None, 1, RESIZED_IMAGE_HEIGHT, RESIZED_IMAGE_WIDTH])),
+                      protoBytes(12, onnxValueInfo(CharClassifier.CNN_OUTPUT, [None, len(labels)]))])
+    return b"".join([protoInt(1, ONNX_IR_VERSION), protoBytes(2, "TrainCnn.py"), protoBytes(7, graph),
+                     protoBytes(8, protoBytes(1, "") + protoInt(2, ONNX_OPSET)),
+                     protoBytes(14, protoBytes(1, "labels") + protoBytes(2, labels))])
+# end function
+
+
+def exportModel(path, net, labels, meta):
+    with open(path, "wb") as f:
+        f.write(onnxModel(net, labels))
+    info = {"labels": labels, "input": [RESIZED_IMAGE_HEIGHT, RESIZED_IMAGE_WIDTH], "scale": SCALE, "meta": meta}
+    with open(CharClassifier.sidecarPath(path), "w") as f:
+        json.dump(info, f, indent=1, sort_keys=True)
+    try:
+        import onnx
+    except ImportError:
+        return False
+    onnx.checker.check_model(onnx.load(path))
+    return True
+# end function
+
+
+###################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Train the CNN character classifier on a GenData.py model and "
+                                                 "export it to ONNX for CharClassifier.CnnClassifier")
+    parser.add_argument("model", nargs="?", default=ModelStore.MODEL_FILE,
+                        help="compiled KNN model with the training characters (GenData.py output)")
+    parser.add_argument("--output", "-o", default=CNN_FILE, help="ONNX file to write, labels go to the .json beside it")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--holdout", type=float, default=ModelCompact.HOLDOUT,
+                        help="fraction of characters kept out of training to measure accuracy, 0 = train on all")
+    args = parser.parse_args()
+
+    model = ModelStore.loadModel(args.model)
+    if model.meta.get("reduction"):
+        raise SystemExit("%s is compacted (%s), train on the uncompacted model" % (args.model, model.meta["reduction"]))
+    if args.holdout > 0:
+        (trainSamples, trainLabels), (testSamples, testLabels) = ModelCompact.splitHoldout(model, args.holdout,
+                                                                                          args.seed)
+    else:
+        (trainSamples, trainLabels) = (np.asarray(model.samples, np.float32), model.labels)
+        (testSamples, testLabels) = (trainSamples[:0], trainLabels[:0])
+    codes = np.unique(model.labels.reshape(-1))
+    labels = "".join(chr(int(code)) for code in codes)
+    targets = np.searchsorted(codes, trainLabels.reshape(-1))
+
+    start = time.perf_counter()
+    net = train(trainSamples, targets, len(codes), args.epochs, args.seed,
+                log=lambda line: print(line, file=sys.stderr))
+    elapsed = time.perf_counter() - start
+    meta = {"source": args.model, "model_meta": model.meta, "epochs": args.epochs, "seed": args.seed,
+            "train_samples": len(trainLabels), "train_seconds": round(elapsed, 1)}
+    if len(testLabels):
+        truth = testLabels.reshape(-1)
+        cnnAccuracy = float(np.mean(codes[np.argmax(net.predict(toImages(testSamples)), axis=1)] == truth))
+        kNearest = KnnEngine.createKNearest(ModelStore.KnnModel(trainSamples, trainLabels), "numpy")
+        knnAccuracy = float(np.mean(kNearest.findNearest(testSamples, k=ModelCompact.KNN_K)[1].reshape(-1) == truth))
+        meta["holdout"] = {"fraction": args.holdout, "samples": len(truth), "accuracy": round(cnnAccuracy, 4),
+                           "knn_accuracy": round(knnAccuracy, 4)}
+        print("held-out accuracy: cnn %.2f%%, knn %.2f%% (%d characters)" % (100 * cnnAccuracy, 100 * knnAccuracy,
+                                                                             len(truth)))
+    checked = exportModel(args.output, net, labels, meta)
+    print("%d classes, trained on %d characters in %.1f s, written to %s%s"
+          % (len(codes), len(trainLabels), elapsed, args.output, " (onnx.checker ok)" if checked else ""),
+          file=sys.stderr)
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,236 @@
+# VideoPipeline.py
+
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import cv2
+
+import CharClassifier
+import ModelStore
+from Metrics import PipelineMetrics
+from MotionGate import METHODS, POLICIES, MotionGate, formatStats
+from PlateCache import TOLERANCE, TTL, PlateCache
+from Recognizer import LicensePlateRecognizer
+
+# module level variables ##########################################################################
+QUEUE_FRAMES_PER_WORKER = 2     # số frame tối đa chờ trong hàng đợi cho mỗi worker (backpressure)
+POLL_SECONDS = 0.5
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+###################################################################################################
+def readFrames(source, frameQueue, resultQueue, workers, maxFrames=None, gateOptions=None):
+    # Tiến trình đọc: giải mã video, gửi (số thứ tự, frame) cho các worker.
+    # put() sẽ chờ khi hàng đợi đầy, nên đọc video không bao giờ chạy quá xa các worker.
+    # Frame bị MotionGate bỏ qua không gửi cho worker, chỉ báo (số thứ tự, None) thẳng về hàng đợi kết quả.
+    # Khi xong gửi ("reader", thống kê của gate hoặc None) để tiến trình chính biết không còn kết quả nào từ đây
+    gate = MotionGate(**gateOptions) if gateOptions is not None else None
+    cap = cv2.VideoCapture(source)
+    index = 0
+    try:
+        while cap.isOpened() and (maxFrames is None or index < maxFrames):
+            ret, img = cap.read()
+            if not ret:
+                break
+            if gate is None or gate.shouldProcess(img):
+                frameQueue.put((index, img))
+            else:
+                resultQueue.put((index, None))
+            index = index + 1
+    finally:
+        cap.release()
+        resultQueue.put(("reader", gate.stats() if gate is not None else None))
+        for _ in range(workers):
+            frameQueue.put(None)            # báo hết frame cho từng worker
+# end function
+
+
+def recognizeFrames(frameQueue, resultQueue, recognizerOptions):
+    # Tiến trình worker: nạp model 1 lần rồi xử lý các frame cho tới khi nhận None
+    cv2.setNumThreads(1)                    # mỗi worker 1 core, tránh tranh chấp thread của OpenCV
+    try:
+        recognizer = LicensePlateRecognizer(**recognizerOptions)
+        while True:
+            item = frameQueue.get()
+            if item is None:
+                break
+            index, img = item
+            resultQueue.put((index, recognizer.recognize(img)))
+        if recognizer.metrics is not None:
+            resultQueue.put(("metrics", recognizer.metrics))   # số liệu của worker, gộp lại ở tiến trình chính
+    except Exception:
+        resultQueue.put(("error", traceback.format_exc()))
+    resultQueue.put(None)
+# end function
+
+
+###################################################################################################
+def runSerial(source, recognizerOptions=None, maxFrames=None, gate=None):
+    # Cách chạy cũ: 1 tiến trình, 1 vòng lặp. Trả về lần lượt (số thứ tự frame, danh sách PlateResult),
+    # danh sách là None nếu frame bị gate bỏ qua
+    recognizer = LicensePlateRecognizer(**(recognizerOptions or {}))
+    cap = cv2.VideoCapture(source)
+    index = 0
+    try:
+        while cap.isOpened() and (maxFrames is None or index < maxFrames):
+            ret, img = cap.read()
+            if not ret:
+                break
+            if gate is None or gate.shouldProcess(img):
+                yield index, recognizer.recognize(img)
+            else:
+                yield index, None
+            index = index + 1
+    finally:
+        cap.release()
+# end function
+
+
+def runPipeline(source, workers=None, recognizerOptions=None, maxFrames=None, queueSize=None, gateOptions=None,
+                gateStats=None):
+    # 1 tiến trình đọc video + N worker nhận dạng, kết quả được sắp xếp lại đúng thứ tự frame.
+    # gateOptions: tham số của MotionGate chạy trong tiến trình đọc; thống kê của gate được ghi vào dict gateStats
+    # recognizerOptions["metrics"] (PipelineMetrics): mỗi worker đếm trên 1 bản sao, cuối cùng được gộp vào đối tượng này
+    workers = workers or os.cpu_count() or 1
+    queueSize = queueSize or QUEUE_FRAMES_PER_WORKER * workers
+    recognizerOptions = recognizerOptions or {}
+    # Nạp (và nếu cần thì biên dịch lại) model 1 lần ở đây trước khi chạy các worker, như BatchRecognize.py:
+    # lỗi model báo ngay, và N worker không cùng lúc biên dịch lại knn_model.bin
+    if recognizerOptions.get("classifier") is None:
+        ModelStore.loadModel(recognizerOptions.get("modelPath", ModelStore.MODEL_FILE))
+    context = multiprocessing.get_context("spawn")
+    frameQueue = context.Queue(queueSize)
+    resultQueue = context.Queue(queueSize)
+
+    reader = context.Process(target=readFrames, args=(source, frameQueue, resultQueue, workers, maxFrames, gateOptions),
+                             daemon=True)
+    pool = [context.Process(target=recognizeFrames, args=(frameQueue, resultQueue, recognizerOptions),
+                            daemon=True) for _ in range(workers)]
+    reader.start()
+    for p in pool:
+        p.start()
+
+    waiting = {}                            # kết quả về sớm hơn thứ tự, chờ frame trước đó
+    nextIndex = 0
+    running = workers + 1                   # các worker + tiến trình đọc
+    try:
+        while running:
+            try:
+                item = resultQueue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if not any(p.is_alive() for p in pool):
+                    raise PipelineError("all workers exited unexpectedly")
+                continue
+            if item is None:
+                running = running - 1
+                continue
+            index, plates = item
+            if index == "error":
+                raise PipelineError("worker failed:\n" + plates)
+            if index == "metrics":
+                recognizerOptions["metrics"].merge(plates)
+                continue
+            if index == "reader":
+                running = running - 1
+                if gateStats is not None and plates is not None:
+                    gateStats.update(plates)
+                continue
+            waiting[index] = plates
+            while nextIndex in waiting:
+                yield nextIndex, waiting.pop(nextIndex)
+                nextIndex = nextIndex + 1
+    finally:
+        for p in [reader] + pool:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+# end function
+
+
+###################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-process license plate recognition on a video")
+    parser.add_argument("source", help="video file or stream URL")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="recognition processes, 0 = serial")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--backend", default="opencv", help="KNN backend of the recognizer")
+    parser.add_argument("--compare", action="store_true", help="also run the serial path and check the results match")
+    parser.add_argument("--gate", choices=POLICIES, default="always", help="motion gate policy")
+    parser.add_argument("--gate-method", choices=METHODS, default="diff")
+    parser.add_argument("--gate-roi", type=int, nargs=4, metavar=("X", "Y", "W", "H"), default=None,
+                        help="region watched for motion")
+    parser.add_argument("--idle-every", type=int, default=10, help="adaptive gate: process 1 of N static frames")
+    parser.add_argument("--detect-scale", type=float, default=None,
+                        help="find plates on a frame downscaled by this factor first, then refine only those regions")
+    parser.add_argument("--roi", type=int, nargs=4, metavar=("X", "Y", "W", "H"), default=None,
+                        help="only look for plates inside this region of the frame")
+    parser.add_argument("--metrics", default=None, help="write per-stage timings and counters here (Prometheus text)")
+    parser.add_argument("--plate-cache", action="store_true",
+                        help="reuse the reading of a near-identical plate crop instead of running OCR again")
+    parser.add_argument("--cache-tolerance", type=int, default=TOLERANCE, help="Hamming distance in bits")
+    parser.add_argument("--cache-ttl", type=float, default=TTL, help="seconds before a reading is redone")
+    parser.add_argument("--classifier", default=None, help="ONNX character CNN from TrainCnn.py, default: KNN")
+    parser.add_argument("--classifier-engine", choices=CharClassifier.ENGINES, default="opencv",
+                        help="runtime for --classifier")
+    args = parser.parse_args()
+
+    options = {"backend": args.backend, "detectScale": args.detect_scale, "roi": args.roi,
+               "metrics": PipelineMetrics() if args.metrics else None,
+               "cache": PlateCache(ttl=args.cache_ttl, tolerance=args.cache_tolerance) if args.plate_cache else None,
+               "classifier": os.path.abspath(args.classifier) if args.classifier else None,
+               "classifierEngine": args.classifier_engine}
+    if args.compare and options["cache"] is not None:
+        # Mỗi worker có 1 bản sao cache riêng còn lần chạy tuần tự dùng chung 1 cache cho mọi frame: hit / miss khác
+        # nhau nên kết quả có thể lệch dù không có lỗi. --compare kiểm tra pipeline nên chạy cả 2 lần không có cache
+        print("--compare: running both passes without --plate-cache")
+        options["cache"] = None
+    gateOptions = None
+    if args.gate != "always":
+        gateOptions = {"policy": args.gate, "method": args.gate_method, "roi": args.gate_roi,
+                       "idleEvery": args.idle_every}
+    gateStats = {}
+    start = time.perf_counter()
+    if args.workers:
+        frames = runPipeline(args.source, args.workers, options, args.max_frames, gateOptions=gateOptions,
+                             gateStats=gateStats)
+    else:
+        gate = MotionGate(**gateOptions) if gateOptions is not None else None
+        frames = runSerial(args.source, options, args.max_frames, gate)
+
+    readings = []
+    for index, plates in frames:
+        readings.append(None if plates is None else [plate.text for plate in plates])
+        for plate in plates or []:
+            print("frame %d: %s - %s" % (index, plate.first_line, plate.second_line))
+    elapsed = time.perf_counter() - start
+    print("%d frames in %.2f s, %.1f frames/sec with %d workers" % (len(readings), elapsed, len(readings) / elapsed,
+                                                                   args.workers))
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(options["metrics"].prometheusText())
+    if gateOptions is not None:
+        if not args.workers:
+            gateStats = gate.stats()
+        print(formatStats(gateStats))
+
+    if args.compare:
+        options["metrics"] = None
+        gate = MotionGate(**gateOptions) if gateOptions is not None else None
+        serial = [None if plates is None else [plate.text for plate in plates]
+                  for _, plates in runSerial(args.source, options, args.max_frames, gate)]
+        if serial != readings:
+            raise SystemExit("pipelined results differ from the serial path")
+        print("pipelined results match the serial path frame for frame")
+# end function
+
+
+if __name__ == "__main__":
+    main()
+# end if
@@ -0,0 +1,82 @@
+# test_geometry.py
+# Geometry.py phải giữ / bỏ đúng các contour như vòng lặp cũ (GeometryReference.filterQuadsReference) trên ảnh mẫu.
+# Chạy: python -m pytest test_geometry.py (hoặc python -m unittest test_geometry)
+
+import os
+import unittest
+
+import numpy as np
+
+import Detection
+import Geometry
+import Preprocess
+from GeometryReference import (DEFAULT_IMAGES, DEGENERATE_QUADS, filterQuadsReference, loadFrames, plateAngleReference,
+                               tiltedFrames)
+from Recognizer import cropPlate
+
+# module level variables ##########################################################################
+CONTOURS = 100                  # contour lớn nhất mỗi frame (nhiều hơn MAX_CANDIDATES để có cả contour bị loại)
+IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_IMAGES)
+
+
+###################################################################################################
+def sampleContours():
+    # Ảnh mẫu ở độ phân giải gốc, ở 1920x1080 và xoay +-12 độ
+    frames = loadFrames(IMAGES, None) + tiltedFrames(loadFrames(IMAGES))
+    for path, img in frames:
+        _, imgThreshplate = Preprocess.preprocess(img)
+        yield path, imgThreshplate, Detection.plateContours(imgThreshplate, CONTOURS)
+# end function
+
+
+###################################################################################################
+class GeometryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cases = list(sampleContours())
+
+    def setUp(self):
+        self.assertTrue(self.cases, "no sample images in " + IMAGES)
+
+    def testSameDecisionsAsOldLoop(self):
+        kept = 0
+        rejected = 0
+        for path, _, contours in self.cases:
+            expected = filterQuadsReference(contours)
+            actual = Detection.filterQuads(contours)
+            self.assertEqual(len(expected), len(actual), path)
+            for a, b in zip(expected, actual):
+                self.assertTrue(np.array_equal(a, b), path)
+                self.assertEqual(a.shape, b.shape)
+                self.assertEqual(a.dtype, b.dtype)
+            kept += len(actual)
+            rejected += len(contours) - len(actual)
+        self.assertGreater(kept, 0)
+        self.assertGreater(rejected, 0)
+
+    def testAnglesGiveSameDeskew(self):
+        for path, imgThreshplate, contours in self.cases:
+            quads = [q.reshape(4, 1, 2) for q in Geometry.approxQuads(contours)[0]]
+            for screenCnt, angle in zip(quads, Geometry.plateAngles(quads)):
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    reference = plateAngleReference(screenCnt)
+                if np.isnan(reference) or reference == angle:
+                    continue
+                self.assertTrue(np.array_equal(cropPlate(None, imgThreshplate, screenCnt, reference)[1],
+                                               cropPlate(None, imgThreshplate, screenCnt, angle)[1]), path)
+
+    def testDegenerateQuads(self):
+        angles = Geometry.plateAngles(np.array([quad for quad, _ in DEGENERATE_QUADS])).tolist()
+        for (quad, expected), angle in zip(DEGENERATE_QUADS, angles):
+            if expected is None:
+                expected = plateAngleReference(np.array(quad).reshape(4, 1, 2))
+            self.assertAlmostEqual(angle, expected, msg=str(quad))
+        self.assertEqual(Geometry.plateAngles([]).shape, (0,))
+        self.assertEqual(Detection.filterQuads([]), [])
+# end class
+
+
+if __name__ == "__main__":
+    unittest.main()
+# end if